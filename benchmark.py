@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+"""benchmark.py -- Timing benchmarks for the Minesweeper game and solver
+Copyright 2010 Roy van de Water <support@royvandewater.com>
+
+Run "python benchmark.py floodfill" to time the cascade in Minefield.open()
+on open areas from 10^2 up to 10^7 tiles.  The largest one needs a little
+over 2GB of memory.
+
+Run "python benchmark.py encodings" to compare the time gringo needs to
+ground the shipped cases, and the size of the result, between the mineBroom
+encoding and the frontier-restricted mineBroomFrontier encoding.  Both are
+written for gringo 3, which has to be on the path.
+
+Run "python benchmark.py solver" to time one solver iteration on the shipped
+case1-case6 boards and on generated boards of several sizes and densities.
+Every stage is timed on its own: decomposing the frontier, serializing,
+grounding, solving, parsing and intersecting the models, and applying the
+deductions.  The results are written as a JSON report.  Every component
+of the frontier goes to the backend, without the local rules or the pattern
+cache of the game; "sweeper.py --batch N --no-cache" times a backend over
+whole games the same way.
+
+Run "python benchmark.py replay" to time playing move logs back, in full
+and up to their middle move, first from the start and then from the
+snapshots kept by the first run.  Logs written with "sweeper.py --record"
+can be given after "replay"; without any, a game on every generated size
+is played by the native solver and recorded first.
+"""
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+
+import gc
+import getopt
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import solvers
+import sweeper
+from sweeper import Minefield, Replay
+
+# The shipped test cases with the r and c constants from the README; the
+# first coordinate of their facts runs up to r and the second up to c
+CASES = [('case1', 3, 3), ('case2', 3, 3), ('case3', 3, 3), ('case4', 3, 3),
+         ('case5', 4, 5), ('case6', 4, 5)]
+
+# Generated boards, as rows and columns, and their mine densities
+SIZES = [(9, 9), (16, 16), (16, 30), (50, 50), (100, 100)]
+DENSITIES = [0.12, 0.16, 0.2]
+
+STAGES = ('decompose', 'serialize', 'ground', 'solve', 'parse', 'apply')
+
+
+def bench_floodfill(min_exponent = 2, max_exponent = 7):
+    """Time opening a mine-free square field of 10^k tiles for every k.
+
+    A field without mines opens completely from a single click, so the
+    whole field is one open area.  Returns a list of 2-tuples of the number
+    of opened tiles and the time taken in seconds.
+
+    The cyclic garbage collector is switched off while timing: its passes
+    over the tens of millions of result tuples of the largest fields would
+    otherwise swamp the time of the fill itself.
+    """
+    results = []
+    for exponent in range(min_exponent, max_exponent + 1):
+        side = int(round(math.sqrt(10 ** exponent)))
+        minefield = Minefield(side, side, 0)
+        gc.disable()
+        start = time.time()
+        opened = minefield.open(side // 2, side // 2)
+        results.append((len(opened), time.time() - start))
+        gc.enable()
+        del opened, minefield
+    return results
+
+
+def case_boards(directory):
+    """Yield the shipped test cases as (info, minefield, playable) tuples.
+
+    The first coordinate of a fact is the x coordinate of a Minefield, which
+    runs over the columns.  The cases only hold what a player sees, so they
+    are not playable: their deductions can not be applied.
+    """
+    for name, r, c in CASES:
+        f = open(os.path.join(directory, name))
+        text = f.read()
+        f.close()
+        info = {'name': name, 'rows': c, 'cols': r}
+        minefield = Minefield.from_facts(text, c, r)
+        info['mines'] = minefield.mines
+        yield info, minefield, False
+
+def generated_boards(sizes, densities, seed, reveal):
+    """Yield generated mid-game boards as (info, minefield, playable) tuples.
+
+    Every board gets its first click in the middle; then random safe tiles
+    are opened until the fraction reveal of all safe tiles is open.
+    """
+    for rows, cols in sizes:
+        for density in densities:
+            mines = int(round(rows * cols * density))
+            minefield = Minefield(rows, cols, mines, seed)
+            minefield.open(cols // 2, rows // 2)
+            picker = random.Random(seed)
+            target = int(reveal * (rows * cols - mines))
+            while minefield.cleared < target:
+                x = picker.randrange(cols)
+                y = picker.randrange(rows)
+                if minefield.get_value(x, y) != -1:
+                    minefield.open(x, y)
+            info = {'name': '%ix%i-%i' % (rows, cols, mines), 'rows': rows,
+                    'cols': cols, 'mines': mines, 'seed': seed}
+            yield info, minefield, True
+
+def run_gringo(facts, minefield, encoding = 'mineBroom'):
+    """Ground an encoding with gringo on the given facts.
+
+    Returns a 2-tuple of the ground program and the time taken.
+    """
+    f = tempfile.NamedTemporaryFile(prefix='input')
+    f.write(facts)
+    f.flush()
+    # serialize() emits the x coordinate (one of cols) first
+    r = minefield.cols
+    c = minefield.rows
+    start = time.time()
+    gringo = subprocess.Popen(["gringo", "-c", "r=%i" % r, "-c", "c=%i" % c,
+                               "-c", "n=%i" % max(r, c),
+                               solvers.encoding_path(encoding), f.name],
+                              stdout=subprocess.PIPE)
+    ground = gringo.communicate()[0]
+    seconds = time.time() - start
+    f.close()
+    return ground, seconds
+
+def run_clasp(ground):
+    """List every answer set of a ground program with clasp.
+
+    Returns a 2-tuple of the output of clasp and the time taken.
+    """
+    start = time.time()
+    clasp = subprocess.Popen(["clasp", "-n", "0"], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE)
+    output = clasp.communicate(ground)[0]
+    return output, time.time() - start
+
+def bench_board(info, minefield, playable, backend):
+    """Run and time one solver iteration on the whole frontier of a board.
+
+    Returns a dict for the report: the info about the board, the time of
+    every stage in seconds (None for stages the backend does not have),
+    the size of the frontier, the number of deductions and, for the clasp
+    backend, the size of the ground programs and the number of models.
+    """
+    record = dict(info)
+    record['backend'] = backend
+    record['known'] = minefield.cleared + minefield.flags
+    stages = dict.fromkeys(STAGES)
+
+    start = time.time()
+    components = solvers.frontier_components(minefield)
+    stages['decompose'] = time.time() - start
+    record['components'] = len(components)
+    record['frontier'] = sum([len(component.cells)
+                              for component in components])
+
+    mines = set()
+    safe = set()
+    if backend == 'clasp':
+        for stage in ('serialize', 'ground', 'solve', 'parse'):
+            stages[stage] = 0.0
+        record['ground_bytes'] = 0
+        record['ground_lines'] = 0
+        record['models'] = 0
+        for component in components:
+            start = time.time()
+            facts = component.serialize(minefield, True, True)
+            stages['serialize'] = stages['serialize'] + time.time() - start
+
+            ground, seconds = run_gringo(facts, minefield, 'mineBroomFrontier')
+            stages['ground'] = stages['ground'] + seconds
+            record['ground_bytes'] = record['ground_bytes'] + len(ground)
+            record['ground_lines'] = (record['ground_lines'] +
+                                      ground.count('\n'))
+
+            output, seconds = run_clasp(ground)
+            stages['solve'] = stages['solve'] + seconds
+
+            start = time.time()
+            master_set = None
+            for model in solvers.read_models(output.splitlines(),
+                                             set(component.cells)):
+                record['models'] = record['models'] + 1
+                if master_set is None:
+                    master_set = model
+                else:
+                    master_set.intersection_update(model)
+            if master_set is not None:
+                component_mines, component_safe = solvers.split_atoms(master_set)
+                mines.update(component_mines)
+                safe.update(component_safe)
+            stages['parse'] = stages['parse'] + time.time() - start
+    else:
+        solver = solvers.get_backend(backend)
+        start = time.time()
+        for component in components:
+            component_mines, component_safe = solver.solve(minefield, component)
+            mines.update(component_mines)
+            safe.update(component_safe)
+        stages['solve'] = time.time() - start
+    record['deductions'] = {'mines': len(mines), 'safe': len(safe)}
+
+    if playable:
+        copy = Minefield.from_snapshot(minefield.snapshot())
+        start = time.time()
+        for x, y in mines:
+            copy.flag(x, y)
+        copy.open(list(safe))
+        stages['apply'] = time.time() - start
+
+    record['stages'] = stages
+    record['total'] = sum([seconds for seconds in stages.values()
+                           if seconds is not None])
+    return record
+
+def bench_solver(backend, seed = 1, reveal = 0.3, directory = None):
+    """Benchmark a solver backend on the cases and on generated boards.
+
+    Returns the report as a dict.
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    records = []
+    for boards in (case_boards(directory),
+                   generated_boards(SIZES, DENSITIES, seed, reveal)):
+        for info, minefield, playable in boards:
+            records.append(bench_board(info, minefield, playable, backend))
+    return {'benchmark': 'solver', 'backend': backend,
+            'python': sys.version.split()[0],
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seed': seed, 'reveal': reveal, 'boards': records}
+
+def bench_encodings(directory = None, repeat = 5):
+    """Compare grounding with mineBroom and with mineBroomFrontier.
+
+    Every shipped case is grounded with both encodings, from the full facts
+    of Minefield.serialize() for mineBroom and from the frontier facts for
+    mineBroomFrontier.  Returns a list of dicts, one per case and encoding,
+    with the best grounding time of repeat runs and the size of the ground
+    program.
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    records = []
+    for info, minefield, playable in case_boards(directory):
+        for encoding, facts in (('mineBroom', minefield.serialize()),
+                                ('mineBroomFrontier',
+                                 minefield.serialize(frontier=True))):
+            best = None
+            for i in range(repeat):
+                ground, seconds = run_gringo(facts, minefield, encoding)
+                if best is None or seconds < best:
+                    best = seconds
+            record = dict(info)
+            record.update({'encoding': encoding,
+                           'facts': facts.count('\n') + 1,
+                           'ground': best, 'ground_bytes': len(ground),
+                           'ground_lines': ground.count('\n')})
+            records.append(record)
+    return records
+
+def bench_replay(paths = (), seed = 1):
+    """Time playing move logs back.
+
+    paths are the move logs to play back; without any, a game on every
+    generated size is recorded to a temporary file first.  Returns a list
+    of dicts, one per log, with its number of moves and bytes, the time of
+    a full replay without snapshots, and the times of going to the middle
+    move twice: from the first move, keeping snapshots, and then from them.
+    """
+    logs = []
+    for path in paths:
+        f = open(path, 'rb')
+        logs.append((os.path.basename(path), f.read()))
+        f.close()
+    if not paths:
+        for rows, cols in SIZES:
+            handle, path = tempfile.mkstemp()
+            os.close(handle)
+            sweeper.play_headless(rows, cols, int(round(rows * cols * 0.16)),
+                                  seed, 'native', record=path)
+            f = open(path, 'rb')
+            logs.append(('%ix%i' % (rows, cols), f.read()))
+            f.close()
+            os.remove(path)
+
+    records = []
+    for name, data in logs:
+        replay = Replay(data, None)
+        start = time.time()
+        replay.field()
+        full = time.time() - start
+        middle = len(replay.moves) // 2
+        replay = Replay(data, max(1, middle // 10))
+        start = time.time()
+        replay.field(middle)
+        first = time.time() - start
+        start = time.time()
+        replay.field(middle)
+        again = time.time() - start
+        records.append({'name': name, 'moves': len(replay.moves),
+                        'bytes': len(data), 'full': full,
+                        'middle': first, 'snapshot': again})
+    return records
+
+def print_solver_report(report):
+    """Print a table of a solver report"""
+    print "%-14s %6s %6s %6s %9s %9s %9s %9s" % ("board", "front", "comps",
+                                                 "found", "ground", "solve",
+                                                 "total", "models")
+    for record in report['boards']:
+        ground = record['stages']['ground']
+        print "%-14s %6i %6i %6i %9s %9.4f %9.4f %9s" % (
+            record['name'], record['frontier'], record['components'],
+            record['deductions']['mines'] + record['deductions']['safe'],
+            ground is None and '-' or '%.4f' % ground,
+            record['stages']['solve'], record['total'],
+            record.get('models', '-'))
+
+
+def show_usage(error = None):
+    if error is not None:
+        print "Error: %s." % error
+    print "Usage: %s [--min EXPONENT] [--max EXPONENT] floodfill" % sys.argv[0]
+    print "       %s encodings" % sys.argv[0]
+    print "       %s [-b,--backend BACKEND] [--report FILE] [--seed SEED]" % sys.argv[0],
+    print "[--reveal FRACTION] solver"
+    print "       %s [--seed SEED] replay [LOG...]" % sys.argv[0]
+    print "  --min, --max:        Smallest and largest open area, as a power",
+    print "of 10 (default 2 and 7)."
+    print "  -b,--backend:        Solver backend to benchmark (default native)."
+    print "  --report:            Write the JSON report to FILE and print a",
+    print "table; without it the JSON goes to standard output."
+    print "  --seed:              Seed for the generated boards and the",
+    print "recorded games (default 1)."
+    print "  --reveal:            Fraction of the safe tiles opened on the",
+    print "generated boards (default 0.3)."
+    if error is None:
+        sys.exit(0)
+    else:
+        sys.exit(2)
+
+def main(argv):
+    try:
+        options, arguments = getopt.getopt(argv, 'hb:',
+                                           ['help', 'min=', 'max=', 'backend=',
+                                            'report=', 'seed=', 'reveal='])
+    except getopt.error:
+        show_usage(sys.exc_info()[1])
+
+    min_exponent = 2
+    max_exponent = 7
+    backend = 'native'
+    report_path = None
+    seed = 1
+    reveal = 0.3
+    try:
+        for option, argument in options:
+            if option in ('-h', '--help'):
+                show_usage()
+            elif option == '--min':
+                min_exponent = int(argument)
+            elif option == '--max':
+                max_exponent = int(argument)
+            elif option in ('-b', '--backend'):
+                if argument not in solvers.backends:
+                    show_usage("Unknown solver backend (%s)" % argument)
+                backend = argument
+            elif option == '--report':
+                report_path = argument
+            elif option == '--seed':
+                seed = int(argument)
+            elif option == '--reveal':
+                reveal = float(argument)
+    except ValueError:
+        show_usage(sys.exc_info()[1])
+
+    if arguments == ['floodfill']:
+        print "%12s %12s %16s" % ("tiles", "seconds", "ns per tile")
+        for tiles, seconds in bench_floodfill(min_exponent, max_exponent):
+            print "%12i %12.4f %16.1f" % (tiles, seconds, seconds * 1e9 / tiles)
+    elif arguments == ['encodings']:
+        try:
+            records = bench_encodings()
+        except OSError:
+            show_usage("Could not run gringo (%s)" % sys.exc_info()[1])
+        print "%-8s %-18s %6s %10s %12s %12s" % ("case", "encoding", "facts",
+                                                 "seconds", "ground bytes",
+                                                 "ground lines")
+        for record in records:
+            print "%-8s %-18s %6i %10.4f %12i %12i" % (
+                record['name'], record['encoding'], record['facts'],
+                record['ground'], record['ground_bytes'],
+                record['ground_lines'])
+    elif arguments == ['solver']:
+        try:
+            report = bench_solver(backend, seed, reveal)
+        except OSError:
+            show_usage("Could not run the solver (%s)" % sys.exc_info()[1])
+        if report_path is None:
+            print json.dumps(report, indent=2, sort_keys=True)
+        else:
+            f = open(report_path, 'w')
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.close()
+            print_solver_report(report)
+    elif arguments[:1] == ['replay']:
+        try:
+            records = bench_replay(arguments[1:], seed)
+        except (IOError, ValueError):
+            show_usage("Could not read a move log (%s)" % sys.exc_info()[1])
+        print "%-12s %8s %8s %10s %10s %10s %12s" % ("log", "moves", "bytes",
+                                                     "full", "middle",
+                                                     "snapshot", "moves/s")
+        for record in records:
+            print "%-12s %8i %8i %10.4f %10.4f %10.4f %12.0f" % (
+                record['name'], record['moves'], record['bytes'],
+                record['full'], record['middle'], record['snapshot'],
+                record['moves'] / max(record['full'], 1e-9))
+    else:
+        show_usage("Unknown benchmark")
+
+if __name__=="__main__":
+    main(sys.argv[1:])
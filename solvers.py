@@ -0,0 +1,1581 @@
+"""solvers.py -- Solver backends for the mineBroom Minesweeper solver
+Copyright 2010 Roy van de Water <support@royvandewater.com>
+
+The unknown tiles next to revealed numbers are first split into independent
+components by frontier_components().  Every backend takes a Minefield and
+one of those components and returns a 2-tuple of sets (mines, safe).  mines
+holds the coordinates of every tile of the component that is a mine in all
+possible mine layouts consistent with the revealed numbers and flags; safe
+holds the coordinates of every tile that is a mine in none of them.
+
+The session backends keep a solver session alive between iterations and
+games; only the tiles changed since the previous call are sent to it.
+
+Every backend takes an optional SolverStats, which records the time spent
+in each stage of every solver iteration.
+
+mine_probabilities() gives the chance of every unknown tile to be a mine,
+for guessing when no backend can deduce anything more.
+"""
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+
+import cPickle
+import cStringIO
+import fractions
+import json
+import math
+import os
+import subprocess
+import tempfile
+import time
+
+try:
+    import clingo
+except ImportError:
+    clingo = None
+
+
+def encoding_path(name):
+    """Return the path of an ASP encoding shipped next to this module"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+class ClaspSolver:
+    """Solve the board with an ASP encoding through gringo and clasp.
+
+    The facts around the component are written to a temporary file,
+    grounded with gringo and the answer sets are enumerated with clasp.
+    The result is the intersection of all answer sets, which is kept up to
+    date as clasp prints them; clasp is stopped as soon as the
+    intersection holds no tile of the component any more.
+
+    encoding is mineBroomFrontier, which only grounds the component, or
+    mineBroom, which grounds the adjacency of the whole board.  With the
+    frontier encoding the number of mines left is passed on as well.
+
+    With stats, the time taken by gringo and clasp together is recorded as
+    the solve stage: they run as one pipeline, with clasp solving while
+    gringo is still grounding.
+    """
+    def __init__(self, verbose = False, stats = None,
+                 encoding = 'mineBroomFrontier'):
+        self.verbose = verbose
+        self.stats = stats
+        self.encoding = encoding
+
+    def solve(self, minefield, component):
+        function, arguments = self.task(minefield, component)
+        return function(*arguments + (self.stats,))
+
+    def task(self, minefield, component):
+        """Return the solve of a component as a function and its arguments,
+        which can be run in another process."""
+        start = time.time()
+        frontier = self.encoding == 'mineBroomFrontier'
+        boardstate = component.serialize(minefield, frontier, frontier)
+        if self.stats is not None:
+            self.stats.add('serialize', time.time() - start)
+        # serialize() emits the x coordinate (one of cols) first; a board
+        # without bounds can only be used with the frontier encoding, which
+        # does not need them
+        return solve_facts, (boardstate, component.cells,
+                             minefield.cols or 0, minefield.rows or 0,
+                             self.encoding, self.verbose)
+
+
+def solve_facts(boardstate, cells, r, c, encoding, verbose = False,
+                stats = None):
+    """Run gringo and clasp on the facts of a component, for ClaspSolver.
+
+    cells are the tiles of the component, and r and c the constants of the
+    same name of the encoding.  Returns a 2-tuple of sets (mines, safe).
+    """
+    # Write the current board out to a file of our own, so that games
+    # played side by side in several processes do not mix up their input
+    f = tempfile.NamedTemporaryFile(prefix='input')
+    f.write(boardstate)
+    f.flush()
+
+    if(verbose):
+        print(boardstate)
+    if stats is not None:
+        start = time.time()
+        waited = stats.get('solve')
+
+    n = max(r, c)
+    gringo = subprocess.Popen(["gringo", "-c", "r={0}".format(r),
+                               "-c", "c={0}".format(c),
+                               "-c", "n={0}".format(n),
+                               encoding_path(encoding), f.name],
+                              stdout=subprocess.PIPE)
+    clasp = subprocess.Popen(["clasp", "-n", "0"], stdin=gringo.stdout,
+                             stdout=subprocess.PIPE)
+    # Let gringo notice if clasp goes away early
+    gringo.stdout.close()
+
+    # Flags and opened tiles show up in the models as well, only the
+    # tiles of the component are of interest.  master_set is the running
+    # intersection of all models seen so far, None before the first one.
+    cells = set(cells)
+    master_set = None
+    lines = iter(clasp.stdout.readline, '')
+    if(verbose):
+        lines = echo(lines)
+    if stats is not None:
+        lines = timed(lines, stats, 'solve')
+    try:
+        for model in read_models(lines, cells):
+            if stats is not None:
+                stats.add('models', 1)
+            if master_set is None:
+                master_set = model
+            else:
+                master_set.intersection_update(model)
+            if not master_set:
+                # No later model can add anything back
+                break
+    finally:
+        for process in (clasp, gringo):
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+        f.close()
+    if stats is not None:
+        # Whatever was not spent waiting for clasp went into parsing
+        # and intersecting the models
+        stats.add('parse', time.time() - start -
+                  (stats.get('solve') - waited))
+
+    if master_set is None:
+        # The flags contradict the numbers, nothing is certain
+        return set(), set()
+    return split_atoms(master_set)
+
+
+def echo(lines):
+    """Print every line passing through an iterator of lines"""
+    for line in lines:
+        print(line.rstrip())
+        yield line
+
+
+def timed(lines, stats, stage):
+    """Pass on an iterator of lines, adding the time spent waiting for
+    every line to a stage of a SolverStats"""
+    lines = iter(lines)
+    while True:
+        start = time.time()
+        try:
+            line = lines.next()
+        finally:
+            stats.add(stage, time.time() - start)
+        yield line
+
+
+# The atoms of a model which tell whether a tile holds a mine; gringo 3
+# shows every other atom too unless the encoding hides them
+ANSWER_ATOMS = ('mine', 'not_a_mine')
+
+def read_models(lines, cells):
+    """Yield the models in clasp output, one at a time.
+
+    lines is any iterable over the lines printed by clasp.  Every model is
+    yielded as a set of 2-tuples, as returned by parse_atom(), holding only
+    the mine and not_a_mine atoms about tiles in cells; any other atom, such
+    as a helper predicate of the encoding, is left out.
+    """
+    answer = False
+    for line in lines:
+        if line.startswith("Answer:"):
+            answer = True
+            continue
+        elif not answer:
+            continue
+        answer = False
+
+        model = set()
+        for square in line.split():
+            if ('(' not in square or
+                    square.split('(', 1)[0] not in ANSWER_ATOMS):
+                continue
+            atom = parse_atom(square)
+            if atom[1] in cells:
+                model.add(atom)
+        yield model
+
+
+def split_atoms(atoms):
+    """Split parsed mine and not_a_mine atoms into a 2-tuple of sets of
+    coordinates (mines, safe).  Atoms of any other name are ignored."""
+    mines = set()
+    safe = set()
+    for name, coords in atoms:
+        if name == "mine":
+            mines.add(coords)
+        elif name == "not_a_mine":
+            safe.add(coords)
+    return mines, safe
+
+
+def parse_atom(square):
+    """Split an atom such as mine(1,2) into its name and coordinates.
+
+    Returns a 2-tuple; the first value is the name of the predicate and the
+    second a tuple of its integer arguments.
+    """
+    name, arguments = square[:-1].split('(')
+    return name, tuple([int(argument) for argument in arguments.split(',')])
+
+
+class NativeSolver:
+    """Solve the board in-process by constraint propagation and search.
+
+    Every revealed number gives a constraint of the form "exactly n of
+    these unknown tiles are mines".  Solutions of that constraint system
+    are searched by backtracking, with a propagation pass after every
+    decision.  Rather than enumerating every solution, one search is run
+    for every tile which has only been seen with one value, asking for a
+    solution with the other value; a tile for which there is none has the
+    same value in every solution and is returned.
+    """
+    def __init__(self, verbose = False, stats = None):
+        self.verbose = verbose
+        self.stats = stats
+
+    def solve(self, minefield, component):
+        if(self.verbose):
+            print("{0} frontier tiles, {1} constraints".format(
+                len(component.cells), len(component.constraints)))
+        return solve_constraints(component.cells, component.constraints,
+                                 self.stats)
+
+    def task(self, minefield, component):
+        """Return the solve of a component as a function and its arguments,
+        which can be run in another process."""
+        return solve_constraints, (component.cells, component.constraints)
+
+
+class Component:
+    """A group of unknown tiles tied together by the numbers around them.
+
+    cells is a list of the coordinates of the unknown tiles.  constraints
+    is a list of 2-tuples; the first value is a tuple of coordinates from
+    cells and the second is the number of mines among them, after
+    discounting the flags around the number.  numbers holds the coordinates
+    of the revealed numbers the constraints come from.  No constraint
+    outside the component mentions any of its tiles, so every component can
+    be solved on its own.
+    """
+    def __init__(self):
+        self.cells = []
+        self.constraints = []
+        self.numbers = []
+
+    def serialize(self, minefield, frontier = False, remaining = False):
+        """Returns the facts needed to solve the component in ASP form.
+
+        Besides the numbers of the component, every opened tile and every
+        flag next to one of them is included, so that the solver can not
+        place a mine on a tile which is known.  If frontier is True, the
+        facts are for the mineBroomFrontier encoding instead and only cover
+        the numbers and tiles of the component; see
+        Minefield.write_frontier_facts() for them and for remaining.
+        """
+        if frontier:
+            output = cStringIO.StringIO()
+            minefield.write_frontier_facts(output, self.numbers, remaining)
+            return output.getvalue()[:-1]
+        opened = set(self.numbers)
+        for x, y in self.numbers:
+            for adjx, adjy in minefield._get_adjacent(x, y):
+                if minefield.is_uncovered(adjx, adjy):
+                    opened.add((adjx, adjy))
+        flags = set()
+        for x, y in opened:
+            for adjx, adjy in minefield._get_adjacent(x, y):
+                if minefield.is_flagged(adjx, adjy):
+                    flags.add((adjx, adjy))
+
+        squares = list()
+        for x, y in sorted(opened):
+            squares.append("safe({0},{1},{2}).".format(x, y,
+                                                       minefield.get_value(x, y)))
+        for x, y in sorted(flags):
+            squares.append("mine({0},{1}).".format(x, y))
+        return "\n".join(squares)
+
+
+def frontier_components(minefield, changes = None):
+    """Split the unknown tiles next to revealed numbers into components.
+
+    Two unknown tiles belong to the same component when they are next to
+    the same revealed number, directly or through a chain of other tiles.
+    Returns a list of Component instances.  Unknown tiles which are not
+    next to any revealed number are left out.
+
+    If changes is given, it is a list of coordinates of changed tiles, as
+    returned by Minefield.changes_since(); only the components next to
+    those tiles are returned.
+    """
+    if changes is None:
+        # Every opened tile is in the journal
+        numbers = set(minefield.changes_since(0))
+    else:
+        numbers = []
+        for x, y in changes:
+            numbers.append((x, y))
+            numbers.extend(minefield._get_adjacent(x, y))
+
+    constraints = []
+    index = {}
+    owners = {}
+    def add_constraint(x, y):
+        """Add the constraint of an opened tile and return its index"""
+        if (x, y) in index:
+            return index[(x, y)]
+        index[(x, y)] = None
+        if not minefield.is_uncovered(x, y):
+            return None
+        unknown = []
+        flagged = 0
+        for adjx, adjy in minefield._get_adjacent(x, y):
+            if minefield.is_flagged(adjx, adjy):
+                flagged = flagged + 1
+            elif not minefield.is_uncovered(adjx, adjy):
+                unknown.append((adjx, adjy))
+        if not unknown:
+            return None
+        index[(x, y)] = len(constraints)
+        constraints.append(((x, y), tuple(unknown),
+                            minefield.get_value(x, y) - flagged))
+        return index[(x, y)]
+
+    def neighbours(coords):
+        """Return the constraints which mention an unknown tile"""
+        if coords not in owners:
+            owners[coords] = []
+            for adjx, adjy in minefield._get_adjacent(coords[0], coords[1]):
+                ci = add_constraint(adjx, adjy)
+                if ci is not None:
+                    owners[coords].append(ci)
+        return owners[coords]
+
+    starts = []
+    for x, y in numbers:
+        ci = add_constraint(x, y)
+        if ci is not None:
+            starts.append(ci)
+
+    components = []
+    done = set()
+    for start in starts:
+        if start in done:
+            continue
+        component = Component()
+        seen = set()
+        done.add(start)
+        queue = [start]
+        while queue:
+            number, unknown, mines = constraints[queue.pop()]
+            component.numbers.append(number)
+            component.constraints.append((unknown, mines))
+            for coords in unknown:
+                if coords in seen:
+                    continue
+                seen.add(coords)
+                component.cells.append(coords)
+                for other in neighbours(coords):
+                    if other not in done:
+                        done.add(other)
+                        queue.append(other)
+        components.append(component)
+    return components
+
+
+class SolverStats:
+    """Timings and counts of the solver, per iteration and per game.
+
+    Every call to deduce() is one iteration.  The time spent in each stage
+    is added up in seconds: decompose (splitting the frontier), rules (the
+    local rules), serialize (writing the facts, or syncing a session),
+    solve, parse (reading and intersecting clasp models), apply (changing
+    the Minefield) and ui (showing and painting the changes in the
+    window).  Besides, the number of components, of those looked up in a
+    PatternCache (cached) or left to the backend (exact), of clasp models
+    and of mines and safe tiles found are counted.
+
+    games is a list of dicts, one per game: the information passed to
+    new_game() and a list of iterations, each a dict of the stages and
+    counts above.  Everything is plain data, as written by write_json().
+    """
+    STAGES = ('decompose', 'rules', 'serialize', 'solve', 'parse', 'apply',
+              'ui')
+    COUNTS = ('components', 'cached', 'exact', 'models', 'mines', 'safe')
+
+    def __init__(self):
+        self.games = []
+        self.game = None
+        self.iteration = None
+
+    def new_game(self, **info):
+        """Start recording a new game, described by info"""
+        self.game = dict(info)
+        self.game['iterations'] = []
+        self.games.append(self.game)
+        self.iteration = None
+
+    def new_iteration(self):
+        """Start recording a new solver iteration and return it"""
+        if self.game is None:
+            self.new_game()
+        self.iteration = dict.fromkeys(self.STAGES, 0.0)
+        self.iteration.update(dict.fromkeys(self.COUNTS, 0))
+        self.game['iterations'].append(self.iteration)
+        return self.iteration
+
+    def add(self, name, value, iteration = None):
+        """Add to a stage or count of an iteration, the current one by
+        default"""
+        if iteration is None:
+            iteration = self.iteration or self.new_iteration()
+        iteration[name] = iteration[name] + value
+
+    def get(self, name):
+        """Return a stage or count of the current iteration"""
+        if self.iteration is None:
+            return 0
+        return self.iteration[name]
+
+    def totals(self, games = None):
+        """Sum the stages and counts over all iterations of some games, all
+        of them by default.  The result has the number of iterations too."""
+        if games is None:
+            games = self.games
+        result = dict.fromkeys(self.STAGES, 0.0)
+        result.update(dict.fromkeys(self.COUNTS, 0))
+        result['iterations'] = 0
+        for game in games:
+            for iteration in game['iterations']:
+                for name in self.STAGES + self.COUNTS:
+                    result[name] = result[name] + iteration[name]
+                result['iterations'] = result['iterations'] + 1
+        return result
+
+    def as_dict(self):
+        """Return everything recorded, with totals per game and overall"""
+        games = []
+        for game in self.games:
+            game = dict(game)
+            game['totals'] = self.totals([game])
+            games.append(game)
+        return {'games': games, 'totals': self.totals()}
+
+    def write_json(self, output):
+        """Write as_dict() as JSON to a file"""
+        json.dump(self.as_dict(), output, indent=2, sort_keys=True)
+        output.write("\n")
+
+    def print_report(self):
+        """Print a table with the totals of every game and of all games"""
+        print("%-12s %5s" % ("game", "iters") +
+              "".join([" %9s" % name for name in self.STAGES]) +
+              " %6s %6s" % ("models", "found"))
+        rows = [(str(game.get('seed', i + 1)), self.totals([game]))
+                for i, game in enumerate(self.games)]
+        if len(rows) > 1:
+            rows.append(("total", self.totals()))
+        for name, totals in rows:
+            print("%-12s %5i" % (name, totals['iterations']) +
+                  "".join([" %9.4f" % totals[stage]
+                           for stage in self.STAGES]) +
+                  " %6i %6i" % (totals['models'],
+                                totals['mines'] + totals['safe']))
+
+
+def deduce(minefield, solver, changes = None, progress = None,
+           parallel = False, cache = None):
+    """Solve the frontier with a backend and merge the results.
+
+    Every component of the frontier next to the changed tiles, or of the
+    whole frontier if changes is None, is solved on its own: first with the
+    simple rules of local_rules(), and only when they find nothing there
+    with the backend.  Returns a 2-tuple of sets (mines, safe) over all
+    components.
+
+    If cache is a PatternCache, components of up to PATTERN_CELLS tiles
+    which the rules do not settle are looked up there instead of being
+    handed to the backend.
+
+    If progress is given, it is called after every component with the
+    number of components solved so far and their total.  When it returns
+    False the remaining components are skipped and None is returned.
+
+    If parallel is true and the backend has a task() method, the components
+    left for it are solved in the process pool of get_pool() when there are
+    enough of them; see solve_parallel().  The pool is only made once a
+    frontier that large comes up.
+    """
+    stats = solver.stats
+    if stats is not None:
+        stats.new_iteration()
+        start = time.time()
+    mines = set()
+    safe = set()
+    components = frontier_components(minefield, changes)
+    if stats is not None:
+        stats.add('decompose', time.time() - start)
+        stats.add('components', len(components))
+        start = time.time()
+
+    # A component the rules make progress on is looked at again in the
+    # next iteration anyway, as its tiles change
+    done = 0
+    left = []
+    for component in components:
+        component_mines, component_safe = local_rules(component.constraints)
+        if not (component_mines or component_safe):
+            if cache is None or len(component.cells) > PATTERN_CELLS:
+                left.append(component)
+                continue
+            component_mines, component_safe = cache.solve(component)
+            if stats is not None:
+                stats.add('cached', 1)
+        mines.update(component_mines)
+        safe.update(component_safe)
+        done = done + 1
+    if stats is not None:
+        stats.add('rules', time.time() - start)
+        stats.add('exact', len(left))
+    if done and progress is not None and not progress(done,
+                                                      len(components)):
+        return None
+
+    if (parallel and hasattr(solver, 'task') and
+        sum([len(component.cells) for component in left]) >=
+        2 * BATCH_CELLS):
+        results = solve_parallel(minefield, solver, left, get_pool())
+    else:
+        results = (solver.solve(minefield, component) for component in left)
+    for component_mines, component_safe in results:
+        mines.update(component_mines)
+        safe.update(component_safe)
+        done = done + 1
+        if progress is not None and not progress(done, len(components)):
+            return None
+    if stats is not None:
+        stats.add('mines', len(mines))
+        stats.add('safe', len(safe))
+    return mines, safe
+
+
+def local_rules(constraints):
+    """Find the tiles decided by simple rules about one or two numbers.
+
+    constraints are those of a Component.  A number with no mines left
+    around it makes its tiles safe, and one with as many mines left as
+    tiles makes them all mines.  For two numbers A and B sharing tiles, if
+    B needs as many more mines than A as it has tiles of its own, those
+    tiles are mines and the tiles of A outside B are safe.  With no tiles
+    of its own, that is B inside A with as many mines, the tiles of A
+    outside B are safe all the same.
+
+    The constraints wait in a work queue.  Every decided tile is taken out
+    of the constraints around it, which go back on the queue, so the rules
+    are applied until nothing changes.  Returns a 2-tuple of sets (mines,
+    safe), both empty if the rules find nothing or the numbers contradict
+    each other.
+    """
+    members = [set(cells) for cells, need in constraints]
+    need = [need for cells, need in constraints]
+    owners = {}
+    for ci, cells in enumerate(members):
+        for coords in cells:
+            owners.setdefault(coords, set()).add(ci)
+    mines = set()
+    safe = set()
+    queue = range(len(members))
+    queued = set(queue)
+
+    def decide(cells, mine):
+        for coords in list(cells):
+            if coords in mines or coords in safe:
+                continue
+            if mine:
+                mines.add(coords)
+            else:
+                safe.add(coords)
+            for ci in owners[coords]:
+                members[ci].discard(coords)
+                if mine:
+                    need[ci] = need[ci] - 1
+                if ci not in queued:
+                    queued.add(ci)
+                    queue.append(ci)
+
+    while queue:
+        ci = queue.pop()
+        queued.discard(ci)
+        cells = members[ci]
+        if need[ci] < 0 or need[ci] > len(cells):
+            # The flags contradict the numbers
+            return set(), set()
+        if not cells:
+            continue
+        if need[ci] == 0:
+            decide(cells, False)
+            continue
+        if need[ci] == len(cells):
+            decide(cells, True)
+            continue
+        others = set()
+        for coords in cells:
+            others.update(owners[coords])
+        others.discard(ci)
+        for other in others:
+            for a, b in ((ci, other), (other, ci)):
+                own = members[b] - members[a]
+                rest = members[a] - members[b]
+                if (own or rest) and need[b] - need[a] == len(own):
+                    decide(own, True)
+                    decide(rest, False)
+            if not members[ci]:
+                break
+    return mines, safe
+
+
+# Components of up to this many tiles are kept in a PatternCache
+PATTERN_CELLS = 16
+
+# The 8 rotations and reflections of the board
+SYMMETRIES = [lambda x, y: (x, y), lambda x, y: (-y, x),
+              lambda x, y: (-x, -y), lambda x, y: (y, -x),
+              lambda x, y: (-x, y), lambda x, y: (y, x),
+              lambda x, y: (x, -y), lambda x, y: (-y, -x)]
+
+def canonical_pattern(constraints):
+    """Return the canonical form of the constraints of a component.
+
+    The tiles are rotated or reflected, and moved so that the smallest
+    coordinates are 0, in each of the 8 ways; the smallest resulting
+    sorted tuple of (tiles, mines) pairs is the canonical form.  Components
+    with the same form have the same solutions, up to moving the tiles.
+    Returns a 2-tuple of the form and a dict mapping the canonical
+    coordinates back to the tiles of the component.
+    """
+    cells = set()
+    for con_cells, need in constraints:
+        cells.update(con_cells)
+    best = None
+    for symmetry in SYMMETRIES:
+        moved = dict((coords, symmetry(*coords)) for coords in cells)
+        left = min([x for x, y in moved.values()])
+        top = min([y for x, y in moved.values()])
+        for coords, (x, y) in moved.items():
+            moved[coords] = (x - left, y - top)
+        form = tuple(sorted([(tuple(sorted([moved[coords]
+                                            for coords in con_cells])), need)
+                             for con_cells, need in constraints]))
+        if best is None or form < best[0]:
+            best = form, moved
+    form, moved = best
+    return form, dict((canonical, coords)
+                      for coords, canonical in moved.items())
+
+
+class PatternCache:
+    """A least recently used cache of the tiles decided in small patterns.
+
+    Entries map the canonical form of the constraints of a component, as
+    given by canonical_pattern(), to the mines and safe tiles in canonical
+    coordinates.  They are worked out with solve_constraints(), which only
+    looks at the constraints, so an entry holds on any board.  When more
+    than size entries are held, the quarter used longest ago is dropped.
+
+    hits and misses count the lookups.  added holds the entries made since
+    it was last emptied, so that entries learned in worker processes can
+    be merged into one cache with update().  load() and save() keep the
+    cache in a file between runs.
+    """
+    def __init__(self, size = 100000):
+        self.size = size
+        # Every entry is a list [mines, safe, time of last use]
+        self.entries = {}
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.added = {}
+
+    def solve(self, component):
+        """Return a 2-tuple of sets (mines, safe) for a component"""
+        form, tiles = canonical_pattern(component.constraints)
+        self.clock = self.clock + 1
+        if form in self.entries:
+            self.hits = self.hits + 1
+            entry = self.entries[form]
+            entry[2] = self.clock
+        else:
+            self.misses = self.misses + 1
+            moved = dict((coords, canonical)
+                         for canonical, coords in tiles.items())
+            constraints = [(tuple([moved[coords] for coords in con_cells]),
+                            need)
+                           for con_cells, need in component.constraints]
+            mines, safe = solve_constraints(sorted(tiles), constraints)
+            entry = [tuple(sorted(mines)), tuple(sorted(safe)), self.clock]
+            self.store(form, entry)
+            self.added[form] = entry[:2]
+        return (set([tiles[canonical] for canonical in entry[0]]),
+                set([tiles[canonical] for canonical in entry[1]]))
+
+    def store(self, form, entry):
+        """Add an entry, making room if the cache is full"""
+        self.entries[form] = entry
+        if len(self.entries) > self.size:
+            ages = sorted([(entry[2], form)
+                           for form, entry in self.entries.items()])
+            for age, form in ages[:max(len(ages) // 4, 1)]:
+                del self.entries[form]
+
+    def update(self, entries):
+        """Add entries, as found in added, from another cache"""
+        for form, (mines, safe) in entries.items():
+            if form not in self.entries:
+                self.clock = self.clock + 1
+                self.store(form, [mines, safe, self.clock])
+
+    def load(self, path):
+        """Add the entries saved in a file by save(), if it exists"""
+        if not os.path.exists(path):
+            return
+        f = open(path, 'rb')
+        try:
+            self.update(cPickle.load(f))
+        finally:
+            f.close()
+
+    def save(self, path):
+        """Write all entries to a file"""
+        f = open(path, 'wb')
+        try:
+            cPickle.dump(dict((form, entry[:2])
+                              for form, entry in self.entries.items()),
+                         f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+
+
+# The pattern cache shared by all games in a process
+pattern_cache = PatternCache()
+
+
+# Batches of components sent to a worker process hold at least this many
+# tiles, unless they are the last; below twice as many tiles in all, the
+# frontier is solved in process
+BATCH_CELLS = 400
+
+# Process pools for solving components, by number of processes
+pools = {}
+
+def get_pool(processes = None):
+    """Return a process pool for deduce(), one process per core by
+    default.  The pool is created once and kept for later iterations."""
+    import multiprocessing
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes not in pools:
+        pools[processes] = multiprocessing.Pool(processes)
+    return pools[processes]
+
+
+def run_tasks(batch):
+    """Run a batch of tasks made by a backend's task() method.  This runs
+    in a worker process.
+
+    batch is a 2-tuple of the list of tasks and whether to profile them.
+    A task function takes a SolverStats, or None, as its last argument; a
+    profiled batch shares one of its own.  Returns a 2-tuple of the list of
+    results and the iteration recorded, or None if not profiled.
+    """
+    tasks, profile = batch
+    stats = None
+    if profile:
+        stats = SolverStats()
+        stats.new_iteration()
+    results = [function(*arguments + (stats,))
+               for function, arguments in tasks]
+    return results, stats and stats.iteration
+
+
+def solve_parallel(minefield, solver, components, pool):
+    """Solve components in a process pool.
+
+    The components are taken in order and cut into batches of at least
+    BATCH_CELLS tiles, so that small components share the cost of a trip
+    to a worker process; a large component makes a batch on its own.
+    Batches are made small enough for four of them per core, as long as
+    there are components enough, to keep every process busy.  Yields the
+    result of every component in the order of components, so the merged
+    result does not depend on which process finishes first.
+
+    With stats, the time spent waiting for the pool is recorded as the
+    solve stage, and the other stages and counts recorded by the workers,
+    such as parse and models for clasp, are added to the iteration.
+    """
+    import multiprocessing
+    total = sum([len(component.cells) for component in components])
+    size = min(BATCH_CELLS, total // (4 * multiprocessing.cpu_count()) + 1)
+    batches = [[]]
+    cells = 0
+    for component in components:
+        if cells >= size:
+            batches.append([])
+            cells = 0
+        batches[-1].append(solver.task(minefield, component))
+        cells = cells + len(component.cells)
+
+    stats = solver.stats
+    profile = stats is not None
+    batches = [(batch, profile) for batch in batches]
+    start = time.time()
+    for results, recorded in pool.imap(run_tasks, batches):
+        if recorded is not None:
+            for name in stats.STAGES + stats.COUNTS:
+                if name != 'solve':
+                    stats.add(name, recorded[name])
+        for result in results:
+            yield result
+    if stats is not None:
+        stats.add('solve', time.time() - start)
+
+
+def split_constraints(constraints):
+    """Split a list of constraints into independent groups.
+
+    Returns a list of 2-tuples (cells, constraints), one for every group of
+    constraints which share tiles, directly or through other constraints.
+    """
+    owners = {}
+    for ci, (cells, mines) in enumerate(constraints):
+        for coords in cells:
+            owners.setdefault(coords, []).append(ci)
+
+    groups = []
+    done = [False] * len(constraints)
+    for start in range(len(constraints)):
+        if done[start]:
+            continue
+        cells = []
+        group = []
+        seen = set()
+        done[start] = True
+        queue = [start]
+        while queue:
+            ci = queue.pop()
+            group.append(constraints[ci])
+            for coords in constraints[ci][0]:
+                if coords in seen:
+                    continue
+                seen.add(coords)
+                cells.append(coords)
+                for other in owners[coords]:
+                    if not done[other]:
+                        done[other] = True
+                        queue.append(other)
+        groups.append((cells, group))
+    return groups
+
+
+def solve_constraints(cells, constraints, stats = None):
+    """Find the tiles with the same value in every solution.
+
+    cells and constraints are those of a Component.  The
+    function returns a 2-tuple of sets (mines, safe) of coordinates.  If
+    the constraints have no solution at all, both sets are empty.  With
+    stats, the time taken is recorded as the solve stage.
+    """
+    start = time.time()
+    index = dict((coords, i) for i, coords in enumerate(cells))
+    count = len(cells)
+    members = []
+    need = []
+    var_cons = [[] for i in range(count)]
+    for con_cells, mines in constraints:
+        ci = len(members)
+        members.append([index[coords] for coords in con_cells])
+        need.append(mines)
+        for v in members[ci]:
+            var_cons[v].append(ci)
+
+    # Per constraint: number of mines and number of unassigned tiles
+    placed = [0] * len(members)
+    free = [len(m) for m in members]
+    assign = [None] * count
+    trail = []
+
+    def set_value(v, value, queue):
+        assign[v] = value
+        trail.append(v)
+        for ci in var_cons[v]:
+            free[ci] = free[ci] - 1
+            placed[ci] = placed[ci] + value
+            queue.append(ci)
+
+    def undo(length):
+        while len(trail) > length:
+            v = trail.pop()
+            for ci in var_cons[v]:
+                free[ci] = free[ci] + 1
+                placed[ci] = placed[ci] - assign[v]
+            assign[v] = None
+
+    def propagate(queue):
+        while queue:
+            ci = queue.pop()
+            left = need[ci] - placed[ci]
+            if left < 0 or left > free[ci]:
+                return False
+            if free[ci] == 0 or (left != 0 and left != free[ci]):
+                continue
+            value = int(left != 0)
+            for v in members[ci]:
+                if assign[v] is None:
+                    set_value(v, value, queue)
+        return True
+
+    seen_mine = [False] * count
+    seen_safe = [False] * count
+
+    def search():
+        """Look for one solution that extends the current assignment.
+
+        Every free tile is first tried with the value it has not been seen
+        with yet.  A solution is recorded in seen_mine and seen_safe and
+        then undone again; returns whether one was found.
+        """
+        base = len(trail)
+        # Each frame is [trail length, tile, value being tried]
+        stack = []
+        position = 0
+        while True:
+            while position < count and assign[position] is not None:
+                position = position + 1
+            if position == count:
+                break
+            value = int(not seen_mine[position])
+            stack.append([len(trail), position, value])
+            queue = []
+            set_value(position, value, queue)
+            if propagate(queue):
+                continue
+            # Backtrack to the most recent decision with a value left to try
+            ok = False
+            while stack and not ok:
+                frame = stack[-1]
+                undo(frame[0])
+                if frame[2] is not None:
+                    value = 1 - frame[2]
+                    frame[2] = None
+                    queue = []
+                    set_value(frame[1], value, queue)
+                    ok = propagate(queue)
+                else:
+                    stack.pop()
+            if not ok:
+                undo(base)
+                return False
+            # Every tile before the decision is still assigned
+            position = frame[1]
+        for v in range(count):
+            if assign[v]:
+                seen_mine[v] = True
+            else:
+                seen_safe[v] = True
+        undo(base)
+        return True
+
+    models = 0
+    if propagate(range(len(members))) and search():
+        models = 1
+        # Every tile seen with one value only is tried with the other; if
+        # that has no solution the tile is decided, and is kept assigned to
+        # cut down the later searches
+        for v in range(count):
+            if assign[v] is not None or (seen_mine[v] and seen_safe[v]):
+                continue
+            value = int(not seen_mine[v])
+            base = len(trail)
+            queue = []
+            set_value(v, value, queue)
+            if propagate(queue) and search():
+                models = models + 1
+            undo(base)
+            if not (seen_mine[v] and seen_safe[v]):
+                queue = []
+                set_value(v, 1 - value, queue)
+                propagate(queue)
+    if stats is not None:
+        stats.add('solve', time.time() - start)
+
+    mines = set()
+    safe = set()
+    if models == 0:
+        return mines, safe
+    for v in range(count):
+        if seen_mine[v] and not seen_safe[v]:
+            mines.add(cells[v])
+        elif seen_safe[v] and not seen_mine[v]:
+            safe.add(cells[v])
+    return mines, safe
+
+
+def spread_weights(unconstrained, remaining, count):
+    """Return weights for placing the mines left outside the frontier.
+
+    Weight k is proportional to the number of ways to choose remaining - k
+    of unconstrained tiles, for k from 0 up to count - 1.  Only the ratios
+    of these numbers of ways matter, and two neighbouring ones differ by
+    the factor (remaining - k) / (unconstrained - remaining + k + 1), so
+    the logarithms of those small factors are summed up; the binomial
+    coefficients themselves, with hundreds of thousands of digits on large
+    boards, are never computed.  The weights are integers, the largest
+    2**60; a weight which is not 0 is at least 1, so that a tile only gets
+    a probability of 0 or 1 when it has that in every layout.
+    """
+    weights = [0] * count
+    first = max(0, remaining - unconstrained)
+    last = min(count - 1, remaining)
+    if first > last:
+        return weights
+    logs = [0.0]
+    for k in range(first, last):
+        logs.append(logs[-1] + math.log(remaining - k) -
+                    math.log(unconstrained - remaining + k + 1))
+    top = max(logs)
+    for k, log in enumerate(logs):
+        weights[first + k] = max(1, int(math.ldexp(math.exp(log - top), 60)))
+    return weights
+
+
+def add_counts(target, counts, shift = 0):
+    """Add a list of counts by mine number into target, shifted up by shift
+    mines.  target is extended as needed."""
+    if len(target) < len(counts) + shift:
+        target.extend([0] * (len(counts) + shift - len(target)))
+    for k, count in enumerate(counts):
+        target[k + shift] = target[k + shift] + count
+
+
+def multiply_counts(a, b):
+    """Combine two lists of counts by mine number of independent parts."""
+    result = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i + j] = result[i + j] + x * y
+    return result
+
+
+def count_solutions(cells, constraints):
+    """Count the solutions of a component by the number of mines in them.
+
+    cells and constraints are those of a Component.  Returns a 2-tuple
+    (totals, mines): totals[k] is the number of solutions with k mines, and
+    mines[i][k] the number of those in which cells[i] is a mine.
+
+    The solutions are not enumerated.  The tiles are decided in the order
+    of a breadth first walk over the constraints, and the only thing a
+    partial solution passes on to the rest is the number of mines still
+    needed by every constraint which has tiles on both sides.  Partial
+    solutions are merged on that, counted forwards and backwards, and the
+    counts are combined per tile.
+    """
+    order = []
+    seen = set()
+    owners = {}
+    for ci, (con_cells, need) in enumerate(constraints):
+        for coords in con_cells:
+            owners.setdefault(coords, []).append(ci)
+    done = set()
+    for start in range(len(constraints)):
+        if start in done:
+            continue
+        done.add(start)
+        queue = [start]
+        while queue:
+            ci = queue.pop(0)
+            for coords in constraints[ci][0]:
+                if coords in seen:
+                    continue
+                seen.add(coords)
+                order.append(coords)
+                for other in owners[coords]:
+                    if other not in done:
+                        done.add(other)
+                        queue.append(other)
+    for coords in cells:
+        if coords not in seen:
+            order.append(coords)
+
+    count = len(order)
+    position = dict((coords, i) for i, coords in enumerate(order))
+    members = [sorted([position[coords] for coords in con_cells])
+               for con_cells, need in constraints]
+    need = [need for con_cells, need in constraints]
+    var_cons = [[] for i in range(count)]
+    for ci in range(len(members)):
+        for v in members[ci]:
+            var_cons[v].append(ci)
+    # Per tile and constraint: the tiles of the constraint decided later
+    later = [dict((ci, len([w for w in members[ci] if w > v]))
+                  for ci in var_cons[v]) for v in range(count)]
+    # The constraints with tiles decided both before and from tile i on
+    active = [[] for i in range(count + 1)]
+    for ci in range(len(members)):
+        if members[ci]:
+            for i in range(members[ci][0] + 1, members[ci][-1] + 1):
+                active[i].append(ci)
+
+    def step(i, state, value):
+        """Return the state after tile i gets value, None if impossible"""
+        needs = dict(zip(active[i], state))
+        for ci in var_cons[i]:
+            left = needs.get(ci, need[ci]) - value
+            if left < 0 or left > later[i][ci]:
+                return None
+            needs[ci] = left
+        return tuple([needs[ci] for ci in active[i + 1]])
+
+    forward = [{} for i in range(count + 1)]
+    forward[0][()] = [1]
+    for i in range(count):
+        for state, counts in forward[i].items():
+            for value in (0, 1):
+                after = step(i, state, value)
+                if after is not None:
+                    add_counts(forward[i + 1].setdefault(after, []), counts,
+                               value)
+
+    backward = {(): [1]}
+    mines = [None] * count
+    for i in range(count - 1, -1, -1):
+        current = {}
+        mines[i] = []
+        for state in forward[i]:
+            for value in (0, 1):
+                after = step(i, state, value)
+                if after is None or after not in backward:
+                    continue
+                add_counts(current.setdefault(state, []), backward[after],
+                           value)
+                if value:
+                    add_counts(mines[i], multiply_counts(forward[i][state],
+                                                         backward[after]), 1)
+        backward = current
+
+    totals = backward.get((), [])
+    return totals, [mines[position[coords]] for coords in cells]
+
+
+def scaled_ratio(numerator, denominator):
+    """Return numerator / denominator as a float, for arbitrarily large
+    integers with numerator <= denominator."""
+    return float((numerator << 53) // denominator) / (1 << 53)
+
+
+def frontier_probabilities(minefield):
+    """Compute the chance of the unknown tiles to be a mine.
+
+    Every frontier component is counted by count_solutions().  On a board
+    with a fixed number of mines, its solutions are weighted by the number
+    of ways the mines left over can be spread over the unknown tiles next
+    to no revealed number; all mine layouts consistent with the board are
+    equally likely, so the result is exact up to the rounding of those
+    weights by spread_weights().  On a board where every tile
+    is a mine with the same chance, its density, the solutions are
+    weighted by that chance instead, and every component stands on its
+    own.
+
+    Returns a 2-tuple: a dict mapping every unknown tile of the frontier to
+    its probability, and the probability of the other unknown, unflagged
+    tiles, None if there are none.  Returns None if the flags and numbers
+    contradict each other.
+    """
+    components = frontier_components(minefield)
+    counted = []
+    frontier = set()
+    for component in components:
+        counted.append(count_solutions(component.cells, component.constraints))
+        frontier.update(component.cells)
+    probabilities = {}
+
+    if minefield.density is not None:
+        odds = fractions.Fraction(minefield.density).limit_denominator(10**6)
+        mine = odds.numerator
+        clear = odds.denominator - odds.numerator
+        for component, (totals, mines) in zip(components, counted):
+            size = len(component.cells)
+            weight = [mine ** k * clear ** (size - k)
+                      for k in range(size + 1)]
+            layouts = sum([count * weight[k]
+                           for k, count in enumerate(totals)])
+            if not layouts:
+                return None
+            for coords, cell_mines in zip(component.cells, mines):
+                ways = sum([count * weight[k]
+                            for k, count in enumerate(cell_mines)])
+                probabilities[coords] = scaled_ratio(ways, layouts)
+        return probabilities, float(minefield.density)
+
+    unconstrained = (minefield.rows * minefield.cols - minefield.cleared -
+                     minefield.flags - len(frontier))
+    remaining = minefield.mines - minefield.flags
+
+    # The counts of all components but one, for every component
+    before = [[1]]
+    for totals, mines in counted:
+        before.append(multiply_counts(before[-1], totals))
+    after = [1]
+    others = [None] * len(counted)
+    for j in range(len(counted) - 1, -1, -1):
+        others[j] = multiply_counts(before[j], after)
+        after = multiply_counts(after, counted[j][0])
+    everything = after
+
+    # Ways to place the mines left outside the frontier, by the number of
+    # mines on it
+    spread = spread_weights(unconstrained, remaining, len(everything))
+    layouts = sum([count * spread[k] for k, count in enumerate(everything)])
+    if not layouts:
+        return None
+
+    # Components with the same counts have the same weights; small ones
+    # mostly come in a handful of shapes
+    weights = {}
+    for j, component in enumerate(components):
+        totals, mines = counted[j]
+        key = tuple(totals)
+        if key not in weights:
+            # Ways to complete a layout of the component with k mines
+            weights[key] = [sum([count * spread[k + k2]
+                                 for k2, count in enumerate(others[j])
+                                 if count])
+                            for k in range(len(totals))]
+        weight = weights[key]
+        for coords, cell_mines in zip(component.cells, mines):
+            ways = sum([count * weight[k]
+                        for k, count in enumerate(cell_mines)])
+            probabilities[coords] = scaled_ratio(ways, layouts)
+    if not unconstrained:
+        return probabilities, None
+    # Every tile outside is a mine in the same share of the layouts: C(U -
+    # 1, R - k - 1) is C(U, R - k) times (R - k) / U
+    ways = sum([count * spread[k] * (remaining - k)
+                for k, count in enumerate(everything)])
+    return probabilities, scaled_ratio(ways, layouts * unconstrained)
+
+
+def mine_probabilities(minefield):
+    """Compute the chance of every unknown tile to be a mine.
+
+    Returns a dict mapping the coordinates of every unknown, unflagged
+    tile to its probability, as given by frontier_probabilities(), or an
+    empty dict if the flags and numbers contradict each other.  Every tile
+    of the board is visited, so this is for boards of a fixed size.
+    """
+    result = frontier_probabilities(minefield)
+    if result is None:
+        return {}
+    probabilities, outside = result
+    if outside is not None:
+        for x in range(minefield.cols):
+            for y in range(minefield.rows):
+                if not (minefield.is_uncovered(x, y) or
+                        minefield.is_flagged(x, y) or
+                        (x, y) in probabilities):
+                    probabilities[(x, y)] = outside
+    return probabilities
+
+
+def outside_tile(minefield, frontier):
+    """Return an unknown, unflagged tile which is not in frontier.
+
+    On a board with bounds, this is the first such tile in column order,
+    as when every tile was visited.  A board without bounds can not be
+    searched, so there the tiles next to the frontier and then those next
+    to the known tiles are tried.  Returns None if there is no such tile.
+    """
+    def unknown(coords):
+        return not (coords in frontier or minefield.is_uncovered(*coords) or
+                    minefield.is_flagged(*coords))
+    if minefield.cols is not None and minefield.rows is not None:
+        for x in range(minefield.cols):
+            for y in range(minefield.rows):
+                if unknown((x, y)):
+                    return x, y
+        return None
+    for tiles in (sorted(frontier), sorted(set(minefield.changes_since(0)))):
+        for x, y in tiles:
+            for coords in minefield._get_adjacent(x, y):
+                if unknown(coords):
+                    return coords
+    return None
+
+
+def best_guess(minefield):
+    """Return the coordinates of the unknown tile least likely to be a
+    mine, with that probability, as a 2-tuple.  Returns None if there is
+    no unknown tile or the board contradicts itself."""
+    result = frontier_probabilities(minefield)
+    if result is None:
+        return None
+    probabilities, outside = result
+    candidates = [(probability, coords)
+                  for coords, probability in probabilities.items()]
+    if outside is not None:
+        coords = outside_tile(minefield, probabilities)
+        if coords is not None:
+            candidates.append((outside, coords))
+    if not candidates:
+        return None
+    # The weights are rounded, so equal chances may differ in the last bits;
+    # those are ties, broken by the coordinates
+    probability, coords = min(candidates,
+                              key=lambda candidate:
+                                  (round(candidate[0], 12), candidate[1]))
+    return coords, probability
+
+
+class Session:
+    """A long-lived solver session for boards of one size.
+
+    The session holds the revealed numbers and flags of one board.  sync()
+    brings it up to date with a Minefield by sending only the tiles changed
+    since the previous call, or starts over when a different Minefield is
+    passed in.  Subclasses implement reset(), update() and consequences().
+    """
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.minefield = None
+        self.version = 0
+
+    def sync(self, minefield):
+        if minefield is not self.minefield or minefield.version < self.version:
+            self.reset()
+            self.minefield = minefield
+            self.version = 0
+        safe = []
+        flags = []
+        unflags = []
+        for x, y in set(minefield.changes_since(self.version)):
+            if minefield.is_uncovered(x, y):
+                value = minefield.get_value(x, y)
+                if value >= 0:
+                    safe.append((x, y, value))
+            elif minefield.is_flagged(x, y):
+                flags.append((x, y))
+            else:
+                unflags.append((x, y))
+        self.update(safe, flags, unflags)
+        self.version = minefield.version
+
+    def reset(self):
+        """Forget every number and flag."""
+        raise NotImplementedError
+
+    def update(self, safe, flags, unflags):
+        """Add numbers and flags, and remove flags.
+
+        safe is a list of 3-tuples (x, y, value) of newly opened tiles;
+        flags and unflags are lists of coordinates of tiles which were
+        flagged and unflagged, respectively.
+        """
+        raise NotImplementedError
+
+    def consequences(self):
+        """Return a 2-tuple of sets (mines, safe) for the whole board."""
+        raise NotImplementedError
+
+
+class ClingoSession(Session):
+    """A session grounding the mineBroomMulti encoding once with clingo.
+
+    Numbers and flags are external atoms, so an update only flips their
+    truth values, and the cautious consequences (the intersection of all
+    answer sets) are computed by clingo without listing every model.
+    """
+    def __init__(self, rows, cols):
+        Session.__init__(self, rows, cols)
+        if clingo is None:
+            raise ValueError, "the clingo python module is not installed"
+        self.control = clingo.Control(["-c", "r={0}".format(rows),
+                                       "-c", "c={0}".format(cols),
+                                       "--enum-mode=cautious", "0"])
+        self.control.load(encoding_path("mineBroomMulti"))
+        self.control.ground([("base", [])])
+        self.atoms = set()
+
+    def _assign(self, name, args, value):
+        atom = clingo.Function(name, [clingo.Number(arg) for arg in args])
+        self.control.assign_external(atom, value)
+        if value:
+            self.atoms.add(atom)
+        else:
+            self.atoms.discard(atom)
+
+    def reset(self):
+        for atom in self.atoms:
+            self.control.assign_external(atom, False)
+        self.atoms = set()
+
+    def update(self, safe, flags, unflags):
+        for x, y, value in safe:
+            self._assign("flag", (x, y), False)
+            self._assign("safe", (x, y, value), True)
+        for x, y in flags:
+            self._assign("flag", (x, y), True)
+        for x, y in unflags:
+            self._assign("flag", (x, y), False)
+
+    def consequences(self):
+        symbols = None
+        handle = self.control.solve(yield_=True)
+        try:
+            # In cautious mode the last model is the intersection of all
+            for model in handle:
+                symbols = model.symbols(shown=True)
+        finally:
+            handle.close()
+
+        mines = set()
+        safe = set()
+        if symbols is None:
+            return mines, safe
+        for symbol in symbols:
+            coords = tuple(arg.number for arg in symbol.arguments)
+            if symbol.name == "mine":
+                mines.add(coords)
+            else:
+                safe.add(coords)
+        return mines, safe
+
+
+class LocalSession(Session):
+    """A pure-Python stand-in for ClingoSession.
+
+    The numbers and flags are kept in a dict and a set, and every call to
+    consequences() solves them with solve_constraints().  It needs neither
+    clingo nor any other solver to be installed.
+    """
+    def __init__(self, rows, cols):
+        Session.__init__(self, rows, cols)
+        self.reset()
+
+    def reset(self):
+        self.numbers = {}
+        self.flags = set()
+
+    def update(self, safe, flags, unflags):
+        for x, y, value in safe:
+            self.flags.discard((x, y))
+            self.numbers[(x, y)] = value
+        self.flags.update(flags)
+        self.flags.difference_update(unflags)
+
+    def consequences(self):
+        constraints = []
+        for (x, y), value in self.numbers.items():
+            unknown = []
+            flagged = 0
+            for adjx in range(max(x - 1, 0), min(x + 2, self.cols)):
+                for adjy in range(max(y - 1, 0), min(y + 2, self.rows)):
+                    if (adjx, adjy) in self.flags:
+                        flagged = flagged + 1
+                    elif (adjx, adjy) not in self.numbers:
+                        unknown.append((adjx, adjy))
+            if unknown:
+                constraints.append((tuple(unknown), value - flagged))
+
+        mines = set()
+        safe = set()
+        for cells, group in split_constraints(constraints):
+            group_mines, group_safe = solve_constraints(cells, group)
+            mines.update(group_mines)
+            safe.update(group_safe)
+        return mines, safe
+
+
+# Sessions are kept for reuse across games, by class and board size
+sessions = {}
+
+def get_session(session_class, rows, cols):
+    """Return the session of the given class for a board size"""
+    key = (session_class, rows, cols)
+    if key not in sessions:
+        sessions[key] = session_class(rows, cols)
+    return sessions[key]
+
+
+class SessionSolver:
+    """Solve the board through a persistent Session.
+
+    The session is synced and solved once per Minefield version; the
+    components of an iteration then all share that one result.
+    """
+    session_class = None
+
+    def __init__(self, verbose = False, stats = None):
+        self.verbose = verbose
+        self.stats = stats
+        self.solved = None
+        self.result = None
+
+    def solve(self, minefield, component):
+        if self.solved != (minefield, minefield.version):
+            start = time.time()
+            session = get_session(self.session_class, minefield.rows,
+                                  minefield.cols)
+            session.sync(minefield)
+            if self.stats is not None:
+                self.stats.add('serialize', time.time() - start)
+                start = time.time()
+            self.result = session.consequences()
+            if self.stats is not None:
+                self.stats.add('solve', time.time() - start)
+            self.solved = (minefield, minefield.version)
+            if(self.verbose):
+                print(self.result)
+        cells = set(component.cells)
+        mines, safe = self.result
+        return mines & cells, safe & cells
+
+
+class ClingoSolver(SessionSolver):
+    session_class = ClingoSession
+
+
+class LocalSolver(SessionSolver):
+    session_class = LocalSession
+
+
+backends = {'clasp': ClaspSolver, 'native': NativeSolver,
+            'clingo': ClingoSolver, 'local': LocalSolver}
+
+def get_backend(name, verbose = False, stats = None):
+    """Return a solver instance for the backend with the given name.
+
+    If stats is a SolverStats, the backend records its timings in it.
+    """
+    try:
+        backend = backends[name]
+    except KeyError:
+        raise ValueError, "unknown solver backend %s" % name
+    return backend(verbose, stats)
@@ -1,29 +1,100 @@
 #!/usr/bin/env python
-import commands
+import array
+import binascii
+import copy
+import cStringIO
 import getopt
+import itertools
+import math
 import os
 import random
 import re
+import struct
 import sys
+import threading
 import time
 
-import pygtk
-pygtk.require('2.0')
-import gtk
-import pango
+import solvers
 
+# The GTK modules are only imported once a window is opened, see import_gtk()
+gtk = None
+gobject = None
+
+backend = 'clasp'
 solve_auto = False
 limit = False
 verbose = False
+guess = True
+# File to write the solver timings to, as JSON; None when not profiling
+profile = None
+# File to keep the pattern cache of the solver in between runs, if any
+cache_path = None
+# Look small frontier components up in the pattern cache; switched off with
+# --no-cache, so that the backend alone is timed
+use_cache = True
+# Play on a ChunkedMinefield, which is generated as it is explored
+chunked = False
+# File to record the moves of the game to, see MoveLog; None when not
+# recording
+record_path = None
+
+# Smallest and largest size of a tile on the board, in pixels; the tiles
+# grow with the window until the board fits, within these bounds
+TILE_SIZE = 24
+MAX_TILE_SIZE = 64
+# Largest width and height of the board in view when the window opens
+MAX_VIEW = 800
+
+def import_gtk():
+    """Import pygtk and gtk on first use.
+
+    Headless runs never create a Sweeper, so they start without loading
+    GTK at all.  Threads are enabled, since the solver runs in one.
+    """
+    global gtk, gobject
+    if gtk is None:
+        import pygtk
+        pygtk.require('2.0')
+        import gobject as gobject_module
+        import gtk as gtk_module
+        gobject_module.threads_init()
+        gtk = gtk_module
+        gobject = gobject_module
 
 class Sweeper:
-    def __init__(self, row_count, column_count, mine_count):
+    def __init__(self, row_count, column_count, mine_count, seed = None):
         """
         Setup the gtk window
         """
+        import_gtk()
         self.dead = False
         # Instantiate the minefield
-        self.minefield = Minefield(row_count, column_count, mine_count)
+        self.minefield = new_minefield(row_count, column_count, mine_count,
+                                       seed)
+        # Record the moves, if asked to; the log is flushed after every
+        # click and every batch of solver moves
+        self.log_file = None
+        if record_path is not None:
+            self.log_file = open(record_path, 'wb')
+            self.minefield.record_moves(self.log_file)
+        # Pick the solver backend used by solve(), timing it if profiling
+        self.stats = None
+        if profile is not None:
+            self.stats = solvers.SolverStats()
+            self.stats.new_game(rows=row_count, cols=column_count,
+                                mines=mine_count, seed=self.minefield.seed)
+        self.solver = solvers.get_backend(backend, verbose, self.stats)
+        # Journal version of the minefield the solver has caught up with
+        self.solved_version = 0
+        # Bumped to cancel the solve in progress; a solver thread only
+        # touches the board while its generation is the current one
+        self.solve_generation = 0
+        self.solving = False
+        # Profile record of the last solver iteration shown on the board;
+        # the expose events which paint its moves count towards its ui stage
+        self.drawn_iteration = None
+        # Held by the solver thread while it runs
+        self.solver_lock = threading.Lock()
 
         # Create a window
         self.window = gtk.Window(gtk.WINDOW_TOPLEVEL)
@@ -59,42 +130,38 @@ class Sweeper:
         # implemented
         # self.layout_box.pack_start(self.reset_box, False, False, 0)
 
-        # Create the minebox container and a minearray for keeping track of the buttons
-        self.minebox = gtk.Table(rows=row_count, columns=column_count, homogeneous=True)
-        self.minebox.show()
-        self.minelist = list()
-        self.flaglist = list()
-
-        # Put the minebox in the layout box
-        self.layout_box.pack_start(self.minebox, True, True, 0)
+        # The whole board is drawn on a single gtk.Layout, which scrolls by
+        # itself; only the tiles in view are ever painted
+        self.tile_size = TILE_SIZE
+        self.icons = get_icons(self.tile_size)
+        self.board = gtk.Layout()
+        self.board.set_size(column_count * self.tile_size,
+                            row_count * self.tile_size)
+        self.board.add_events(gtk.gdk.BUTTON_PRESS_MASK)
+        self.board.connect("expose_event", self.expose_event)
+        self.board.connect("button_press_event", self.square_clicked_event)
+        self.board.show()
+
+        # What is shown of the mines once the game is lost
+        self.exploded = None
+        self.shown_mines = set()
+
+        # Put the board in a scrolled window in the layout box
+        self.scroller = gtk.ScrolledWindow()
+        self.scroller.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        self.scroller.add(self.board)
+        self.scroller.connect("size_allocate", self.resize_event)
+        self.scroller.show()
+        self.layout_box.pack_start(self.scroller, True, True, 0)
         self.layout_box.show()
 
-        for row in range(row_count):
-            # Add a row to the minearray
-            self.minelist.insert(row, list())
-            self.flaglist.insert(row, list())
-
-            for col in range(column_count):
-                # Create a new button for every square
-                button = gtk.Button()
-
-                # Add a callback onclick function for the button
-                button.connect("button_press_event", self.square_clicked_event, (row,col))
-
-                # Attach the button to the appropriate place in the minebox
-                self.minebox.attach(button, col, 1+col, row, 1+row)
+        # Show the progress of the solver below the board while it runs
+        self.progress = gtk.ProgressBar()
+        self.layout_box.pack_start(self.progress, False, False, 0)
 
-                # Add the button to the row list
-                self.minelist[row].insert(col, button)
-
-                # Add a flag image
-                flag_image = self.get_svg_from_file("flag")
-
-                # Add the flag image to the flaglist
-                self.flaglist[row].insert(col, flag_image)
-
-                # Lastly, display the widget (button)
-                button.show()
+        # Open the window at the size of the board, if it fits
+        self.window.resize(min(column_count * self.tile_size, MAX_VIEW) + 24,
+                           min(row_count * self.tile_size, MAX_VIEW) + 24)
 
 
     def delete_event(self, widget, event, data=None):
@@ -129,34 +196,151 @@ class Sweeper:
             coords,value = mine
 
             if value == 1:
-                button = self.minelist[coords[0]][coords[1]]
-                image = self.get_svg_from_file("mine")
-                button.add(image)
+                self.shown_mines.add(coords)
+        self.redraw_squares(list(self.shown_mines))
+
+
+    def expose_event(self, widget, event):
+        """Paint the tiles in the exposed part of the board
+
+        Only the tiles which overlap the exposed area are drawn; the rest
+        of the board is left alone, however large it is.
+        """
+        if event.window != self.board.bin_window:
+            return False
+        start = time.time()
+        area = event.area
+        size = self.tile_size
+        first_x = max(area.x // size, 0)
+        last_x = min((area.x + area.width - 1) // size, self.minefield.cols - 1)
+        first_y = max(area.y // size, 0)
+        last_y = min((area.y + area.height - 1) // size, self.minefield.rows - 1)
+        for x in range(first_x, last_x + 1):
+            for y in range(first_y, last_y + 1):
+                self.draw_square(x, y, area)
+        if self.drawn_iteration is not None:
+            self.stats.add('ui', time.time() - start, self.drawn_iteration)
+        return True
+
+
+    def draw_square(self, x, y, area):
+        """Paint one tile of the board
+
+        Unopened tiles are drawn as raised buttons; an icon is drawn on top
+        for a flag, a number or a mine.
+        """
+        window = self.board.bin_window
+        style = self.board.style
+        size = self.tile_size
+        left = x * size
+        top = y * size
+
+        if self.minefield.is_uncovered(x, y):
+            style.paint_flat_box(window, gtk.STATE_NORMAL, gtk.SHADOW_NONE,
+                                 area, self.board, "", left, top, size, size)
+        else:
+            style.paint_box(window, gtk.STATE_NORMAL, gtk.SHADOW_OUT, area,
+                            self.board, "button", left, top, size, size)
+
+        icon = None
+        if (x, y) == self.exploded:
+            icon = "bang"
+        elif (x, y) in self.shown_mines:
+            icon = "mine"
+        elif self.minefield.is_flagged(x, y):
+            icon = "flag"
+        elif self.minefield.is_uncovered(x, y):
+            value = self.minefield.get_value(x, y)
+            if value > 0:
+                icon = self.square_value_icon(value)
+        if icon is not None:
+            pixbuf = self.icons[icon]
+            window.draw_pixbuf(None, pixbuf, 0, 0,
+                               left + (size - pixbuf.get_width()) // 2,
+                               top + (size - pixbuf.get_height()) // 2)
+
+
+    def redraw_square(self, x, y):
+        """Have one tile of the board painted again
+
+        Nothing is drawn right away; GTK sends an expose event for the
+        tile if it is in view.
+        """
+        self.redraw_squares([(x, y)])
+
+
+    def redraw_squares(self, squares):
+        """Have a batch of tiles painted again, in one go
+
+        The smallest rectangle holding all the tiles is invalidated at
+        once, so GTK paints them all in a single expose event, and only
+        the part of it in view.
+        """
+        window = self.board.bin_window
+        if window is None or not squares:
+            return
+        xs = [x for x, y in squares]
+        ys = [y for x, y in squares]
+        size = self.tile_size
+        window.invalidate_rect(gtk.gdk.Rectangle(
+            min(xs) * size, min(ys) * size,
+            (max(xs) - min(xs) + 1) * size,
+            (max(ys) - min(ys) + 1) * size), False)
+
+
+    def show_changes(self, flagged, opened):
+        """Show the tiles changed by a move on the board
+
+        flagged is a list of the coordinates of flagged tiles, and opened a
+        list of opened tiles as returned by Minefield.open().  If a mine was
+        opened, the game is lost and every mine is shown.
+        """
+        changed = list(flagged)
+        exploded = None
+        for coords, value in opened:
+            changed.append(coords)
+            # If value is negative, user clicked on a mine
+            if value < 0:
+                exploded = coords
+        if exploded is not None:
+            self.dead = True
+            print("Mine, you are dead")
+            self.exploded = exploded
+        self.redraw_squares(changed)
+        if exploded is not None:
+            self.display_mines()
 
 
-    def flag_square(self, widget, row, col):
+    def flag_square(self, widget, x, y):
         """Toggles marking the square as a mine
 
         The solver uses this data to find new mines. If a safe spot
         is marked in error, the solver may incorrectly deduce that a
         mined spot is safe.
         """
-        flagged = self.minefield.flag(row, col)
+        flagged = self.minefield.flag(x, y)
 
-        button = self.minelist[row][col]
-        flag_image = self.flaglist[row][col]
+        if flagged != -1:
+            self.redraw_square(x, y)
 
-        if(flagged == 1):
-            button.add(flag_image)
-        elif(flagged == 0):
-            button.remove(flag_image)
 
+    def resize_event(self, widget, allocation):
+        """Fit the tiles to the size of the scrolled window
 
-    def get_svg_from_file(self, filename):
-        image = gtk.Image()
-        image.set_from_file("icons/{0}.svg".format(filename))
-        image.show()
-        return image
+        The tiles are made as large as possible for the whole board to be
+        in view, between TILE_SIZE and MAX_TILE_SIZE pixels.  A board which
+        does not fit at TILE_SIZE is scrolled instead.
+        """
+        size = min(allocation.width // self.minefield.cols,
+                   allocation.height // self.minefield.rows)
+        size = max(TILE_SIZE, min(size, MAX_TILE_SIZE))
+        if size == self.tile_size:
+            return
+        self.tile_size = size
+        self.icons = get_icons(size)
+        self.board.set_size(self.minefield.cols * size,
+                            self.minefield.rows * size)
+        self.board.queue_draw()
 
 
     def main(self):
@@ -167,78 +351,191 @@ class Sweeper:
 
     def solve(self):
         """
-        Attempts to solve as much of the board as possible using the solver application
+        Attempts to solve as much of the board as possible using the selected solver backend
+
+        The solver runs in a thread of its own on a copy of the minefield,
+        so the window stays responsive.  Every iteration's deductions are
+        applied to the board from the GTK main loop; a solve already in
+        progress is cancelled first.
         """
-        # raw_input("Press Enter to solve")
-        # Store the current board state so we can compare it later
-        boardstate = self.minefield.serialize()
-        # Write the current board out to a file
-        cwd = os.getcwd()
-        f = open('input', 'w')
-        f.write(boardstate)
-        f.close()
+        self.cancel_solve()
+        self.solving = True
+        self.progress.set_text("Solving")
+        self.progress.set_fraction(0.0)
+        self.progress.show()
+        worker = threading.Thread(target=self.solve_worker,
+                                  args=(self.solve_generation,
+                                        self.minefield.copy(),
+                                        self.solved_version))
+        worker.setDaemon(True)
+        worker.start()
+
+    def cancel_solve(self):
+        """Stop the solve in progress, if there is one
+
+        The solver thread notices at its next component and stops; none of
+        its deductions reach the board any more.
+        """
+        self.solve_generation = self.solve_generation + 1
+        if self.solving:
+            self.solving = False
+            self.progress.hide()
 
-        if(verbose):
-            print(boardstate)
-
-        r = self.minefield.rows
-        c = self.minefield.cols
-        n = max(r, c)
-        command = "gringo -c r={0} -c c={1} -c n={2} mineBroom input | clasp -n 0".format(r,c,n)
-        output = commands.getoutput(command)
-
-        if(verbose):
-            print(output)
-
-        # The first few lines are not important
-        relevant_output = output.split('\n')[3:]
-        # The second to last line contains the number of models
-        number_of_models = int(relevant_output[-2].split()[-1])
-        models = []
-        for i in range(number_of_models):
-            models.append( relevant_output[(1 + 2*i)].split() )
-
-        # We now have something we can work with, a list of models where each model is a 
-        # list of 'mine' and 'not_a_mine' fields. The only guarenteed answers are those that
-        # are present in every single model so we find the intersection of all the models
-        master_set = set(models[0])
-        for model in models[1:]:
-            master_set = master_set.intersection( set(model) )
-
-        # Now we have a working solution, lets change the board state
-        for square in master_set:
-            if square.startswith("mine"):
-                coord_pair = (square[4:][1:-1]).split(',')
-                row = int(coord_pair[0])
-                col = int(coord_pair[1])
-
-                if not self.minefield.is_flagged(row, col):
-                    self.flag_square(None, row, col)
-            else:
-                coord_pair = (square[10:][1:-1]).split(',')
-                row = int(coord_pair[0])
-                col = int(coord_pair[1])
-                if not self.minefield.is_uncovered(row, col):
-                    self.uncover(None, row, col)
-
-        # If board state has changed, rerun the solver
-        if boardstate != self.minefield.serialize():
-            if limit:
+    def solve_worker(self, generation, minefield, solved_version):
+        """Run the solver on a copy of the minefield, in a thread
+
+        The session backends keep state which a cancelled thread and its
+        successor must not share, so one thread runs at a time.
+        """
+        self.solver_lock.acquire()
+        try:
+            self.run_solver(generation, minefield, solved_version)
+        finally:
+            self.solver_lock.release()
+
+    def run_solver(self, generation, minefield, solved_version):
+        """The solve loop of the solver thread
+
+        Only the parts of the frontier around tiles changed since the last
+        iteration are handed to the solver; the rest was already solved
+        as far as possible.  When nothing is certain any more, the tile
+        least likely to be a mine is opened, unless guessing is switched
+        off.  The deductions are applied to the copy right away, and handed
+        to apply_solution() in the main loop to be applied to the board.
+        """
+        def current():
+            return generation == self.solve_generation
+
+        cache = None
+        if use_cache:
+            cache = solvers.pattern_cache
+
+        def progress(done, total):
+            gobject.idle_add(self.show_progress, generation,
+                             "Solving: region {0} of {1}".format(done, total),
+                             float(done) / total)
+            return current()
+
+        dead = False
+        while not dead and current():
+            changes = minefield.changes_since(solved_version)
+            if not changes:
+                if not guess or minefield.won():
+                    break
+                best = solvers.best_guess(minefield)
+                if best is None:
+                    break
+                (x, y), probability = best
+                if probability == 1.0:
+                    # Every tile left is a mine
+                    mines = set()
+                    for x in range(minefield.cols):
+                        for y in range(minefield.rows):
+                            if not (minefield.is_uncovered(x, y) or
+                                    minefield.is_flagged(x, y)):
+                                mines.add((x, y))
+                    minefield.apply(mines, [])
+                    gobject.idle_add(self.apply_solution, generation, mines,
+                                     set(), solved_version)
+                    break
+                print("Guessing {0},{1} ({2:.1%} risk)".format(x, y,
+                                                              probability))
+                for coords, value in minefield.open(x, y):
+                    dead = dead or value < 0
+                gobject.idle_add(self.apply_solution, generation, set(),
+                                 set([(x, y)]), solved_version)
+                continue
+            if(verbose):
+                # Print the facts learned since the previous iteration
+                minefield.write_facts(sys.stdout, solved_version)
+            solved_version = minefield.version
+
+            # Large frontiers are spread over one process per core
+            solution = solvers.deduce(minefield, self.solver, changes,
+                                      progress, parallel=True, cache=cache)
+            if solution is None:
+                return
+            mines, safe = solution
+
+            # Now we have a working solution, lets change the board state
+            start = time.time()
+            flagged, opened = minefield.apply(mines, safe)
+            for coords, value in opened:
+                dead = dead or value < 0
+            iteration = None
+            if self.stats is not None:
+                iteration = self.stats.iteration
+                self.stats.add('apply', time.time() - start, iteration)
+            gobject.idle_add(self.apply_solution, generation, mines, safe,
+                             solved_version, iteration)
+
+            # If board state has changed, rerun the solver
+            if limit and minefield.version != solved_version:
                 raw_input("Press enter to continue")
-            self.solve()
-        elif not self.minefield.won():
+
+        gobject.idle_add(self.finish_solve, generation, dead, minefield.won())
+
+    def apply_solution(self, generation, mines, safe, solved_version,
+                       iteration = None):
+        """Flag and open the tiles deduced by the solver thread
+
+        Called from the GTK main loop; a solution of a cancelled solve is
+        dropped.  The time taken is added to the ui stage of iteration, the
+        profile record of the solver iteration, if there is one, and so is
+        the time expose_event() takes to paint the changed tiles.
+        """
+        if generation != self.solve_generation:
+            return False
+        start = time.time()
+        self.solved_version = solved_version
+        flagged, opened = self.minefield.apply(mines, safe)
+        self.show_changes(flagged, opened)
+        if self.log_file is not None:
+            self.log_file.flush()
+        if iteration is not None:
+            self.stats.add('ui', time.time() - start, iteration)
+        self.drawn_iteration = iteration
+        return False
+
+    def show_progress(self, generation, text, fraction):
+        """Show the progress of the solver thread below the board"""
+        if generation == self.solve_generation:
+            self.progress.set_text(text)
+            self.progress.set_fraction(fraction)
+        return False
+
+    def finish_solve(self, generation, dead, won):
+        """Report the end of a solve, from the GTK main loop"""
+        if generation != self.solve_generation:
+            return False
+        self.solving = False
+        self.progress.hide()
+        if dead:
+            return False
+        elif not won:
             print("Help me, I'm stuck!")
         else:
             print("A winner is you!")
+        return False
 
-    def square_clicked_event(self, widget, event, data=None):
+    def square_clicked_event(self, widget, event):
         """
-        Gets called on gtk button click
+        Gets called on a click on the board
         """
+        x = int(event.x) // self.tile_size
+        y = int(event.y) // self.tile_size
+        if x >= self.minefield.cols or y >= self.minefield.rows:
+            return
+        # The board is about to change under the solver
+        self.cancel_solve()
+        self.drawn_iteration = None
+
         if event.button == 1:
-            self.uncover(widget, data[0], data[1])
+            self.uncover(widget, x, y)
         elif event.button == 3:
-            self.flag_square(widget, data[0], data[1])
+            self.flag_square(widget, x, y)
+        if self.log_file is not None:
+            self.log_file.flush()
 
         # Check to see if the game was won, output to console if so
         if self.minefield.won():
@@ -248,16 +545,16 @@ class Sweeper:
             self.solve()
 
 
-    def square_value_image(self, value):
-        """Loads the svg file corresponding to the value number
+    def square_value_icon(self, value):
+        """Returns the name of the icon for the value number
 
-        The svg loader expects a an integer value x where 1 <= x <= 9
+        The icons are there for an integer value x where 1 <= x <= 9
         """
         image_files = ("one","two","three","four","five","six","seven","eight","nine")
-        return self.get_svg_from_file(image_files[value-1])
+        return image_files[value-1]
 
 
-    def uncover(self, widget, row, col):
+    def uncover(self, widget, x, y):
         """Checks to see if the clicked square was a mine
 
         The method will automatically update the appropriate squares
@@ -268,42 +565,149 @@ class Sweeper:
         square is a mine, the square will show an explosion icon and all
         mines on the board will be revealed.
         """
-        uncovered_squares = self.minefield.open(row, col)
+        uncovered_squares = self.minefield.open(x, y)
 
         if not uncovered_squares:
-            uncovered_squares = self.minefield.open_adjacent(row, col)
+            uncovered_squares = self.minefield.open_adjacent(x, y)
 
-        for square in uncovered_squares:
-            # unpack square ((2, 1), 1) to coordinates and values
-            coords,value = square
-            # If value is negative, user clicked on a mine
-            if value < 0:
-                self.dead = True
-                print("Mine, you are dead")
+        self.show_changes([], uncovered_squares)
 
-                button = self.minelist[coords[0]][coords[1]]
-                image = self.get_svg_from_file("bang")
-                button.add(image)
+# The icons in the icons directory
+ICON_NAMES = ("one", "two", "three", "four", "five", "six", "seven", "eight",
+              "nine", "flag", "mine", "bang")
 
-                self.display_mines()
-            else:
-                button = self.minelist[coords[0]][coords[1]]
-                # Disable the button
-                # button.set_sensitive(False)
-                button.set_relief(gtk.RELIEF_NONE)
-                # If mine is greater than 0, display the number of adjacent mines
-                if value > 0:
-                    # add button image
-                    image = self.square_value_image(value)
-                    button.add(image)
+# Rasterized icons, by tile size
+icon_sets = {}
+
+def get_icons(tile_size):
+    """Return a dict of all icons as pixbufs for tiles of the given size.
+
+    The SVG files are rasterized straight to two thirds of the tile size,
+    once per size; every Sweeper shares the result.
+    """
+    if tile_size not in icon_sets:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "icons")
+        size = tile_size * 2 // 3
+        icons = {}
+        for name in ICON_NAMES:
+            icons[name] = gtk.gdk.pixbuf_new_from_file_at_size(
+                os.path.join(directory, name + ".svg"), size, size)
+        icon_sets[tile_size] = icons
+    return icon_sets[tile_size]
+
+# Tile states, as stored in Minefield.states
+HIDDEN = 0
+FLAGGED = 1
+OPENED = -1
+# The ring of tiles around the playing field, which is never played
+OUTSIDE = 2
+
+# Neighbour offsets in the flat Minefield arrays, by column length
+neighbour_offsets = {}
+
+def get_neighbour_offsets(stride):
+    """Return the index offsets of the 8 tiles around any tile.
+
+    stride is the length of a column in the flat Minefield arrays, border
+    included.  The offsets are computed once per board size.
+    """
+    if stride not in neighbour_offsets:
+        neighbour_offsets[stride] = (-stride - 1, -stride, -stride + 1,
+                                     -1, 1,
+                                     stride - 1, stride, stride + 1)
+    return neighbour_offsets[stride]
+
+# Binary snapshots start with a magic string, then rows, cols, mines and seed
+SNAPSHOT_MAGIC = 'MBS1'
+SNAPSHOT_HEADER = '>4sIIIQ'
+
+def _ones(plane):
+    """Yield the positions of the '1' characters in a plane string."""
+    position = plane.find('1')
+    while position != -1:
+        yield position
+        position = plane.find('1', position + 1)
+
+# Move logs start with the same header, with their own magic string; every
+# move follows as its kind and its coordinates
+MOVE_LOG_MAGIC = 'MBL1'
+MOVE_OPEN = 0
+MOVE_FLAG = 1
+MOVE_CHORD = 2
+MOVE_NAMES = ('open', 'flag', 'chord')
+
+# Moves between the snapshots a Replay keeps
+REPLAY_INTERVAL = 1000
+# Saved Replay snapshots start with a magic string, the length and CRC-32 of
+# the move log they were taken from; every snapshot follows with the number
+# of moves made before it and its length
+SNAPSHOTS_MAGIC = 'MBR1'
+SNAPSHOTS_HEADER = '>4sQI'
+SNAPSHOTS_ENTRY = '>QI'
+
+def _varint(number):
+    """Return a natural number packed into 7 bits per byte, low bits first;
+    the top bit of a byte is set when another one follows."""
+    packed = []
+    while number >= 0x80:
+        packed.append(chr(number & 0x7f | 0x80))
+        number = number >> 7
+    packed.append(chr(number))
+    return ''.join(packed)
+
+class MoveLog:
+    """Record the moves of a game to a binary, append-only log.
+
+    The log starts with a header holding the size, mine count and seed of
+    the field, as in a snapshot, so the field can be built again.  Every
+    move is then appended as one byte for its kind, MOVE_OPEN, MOVE_FLAG or
+    MOVE_CHORD, and its x and y coordinates as variable-length numbers; on
+    most fields a move takes three bytes.  Nothing written is ever changed
+    again, so a log cut short by a crash still holds every move up to the
+    last one written in full.  Use Replay to play a log back.
+    """
+    def __init__(self, output, minefield):
+        """Start a log of the moves on minefield.
+
+        output can be any object with a write method, such as a file opened
+        for binary writing.
+        """
+        self.output = output
+        self.moves = 0
+        output.write(struct.pack(SNAPSHOT_HEADER, MOVE_LOG_MAGIC,
+                                 minefield.rows, minefield.cols,
+                                 minefield.mines, minefield.seed))
+
+    def record(self, move, x, y):
+        """Append a move to the log."""
+        self.output.write(chr(move) + _varint(x) + _varint(y))
+        self.moves = self.moves + 1
+
+    def flush(self):
+        """Make sure the moves recorded so far are written out."""
+        if hasattr(self.output, 'flush'):
+            self.output.flush()
 
 class Minefield:
     """Provide a playing field for a Minesweeper game.
 
     This class internally represents a Minesweeper playing field, and provides
     all functions necessary for the basic manipulations used in the game.
+
+    The field is kept in two flat arrays of bytes, values and states, with
+    one column after another.  A ring of OUTSIDE tiles surrounds the field,
+    so the same 8 neighbour offsets apply to every tile without any bounds
+    checks.  A value is the number of adjacent mines, or -1 for a mine; the
+    values are all counted when the field is created.
     """
-    def __init__(self, rows = 16, cols = 16, mines = 40):
+    # The field holds a fixed number of mines, not a share of its tiles;
+    # see ChunkedMinefield
+    density = None
+    # The MoveLog the moves are recorded to, if any; see record_moves()
+    log = None
+
+    def __init__(self, rows = 16, cols = 16, mines = 40, seed = None):
         """Initialize the playing field.
 
         This function creates a playing field of the given size, and randomly
@@ -311,7 +715,10 @@ class Minefield:
 
         rows and cols are the numbers of rows and columns of the playing
         field, respectively.  mines is the number of mines to be placed within
-        the field.
+        the field.  seed seeds the random number generator of the field; two
+        fields with the same size, mine count and seed are identical, and
+        so is the mine moved by the first click.  If no seed is given, a
+        random one is picked and kept in the seed attribute.
         """
         for var in (rows, cols, mines):
             if var < 0:
@@ -325,27 +732,85 @@ class Minefield:
         self.cleared = 0
         self.flags = 0
         self.start_time = None
-
-        minelist = []
-        self.freecoords = {}
-        for col in range(cols):
-            self.freecoords[col] = range(rows)
-        while mines > 0:
-            y = random.choice(self.freecoords.keys())
-            x = random.randrange(len(self.freecoords[y]))
-            minelist.append((self.freecoords[y][x], y))
-            del self.freecoords[y][x]
-            if not self.freecoords[y]:
-                del self.freecoords[y]
-            mines = mines - 1
-
-        self.board = []
-        for col in range(cols):
-            self.board.append([(-2, 0)] * rows)
-            for row in range(rows):
-                if (row, col) in minelist:
-                    self.board[col][row] = (-1, 0)
-
+        # The index of every opened, flagged or unflagged tile is appended
+        # to the journal; the version is the number of changes made so far
+        self.journal = array.array('l')
+        self.version = 0
+
+        self.stride = rows + 2
+        self.offsets = get_neighbour_offsets(self.stride)
+        size = (cols + 2) * self.stride
+        self.values = array.array('b', [0]) * size
+        self.states = array.array('b', [OUTSIDE]) * size
+        for x in range(cols):
+            start = self._index(x, 0)
+            self.states[start:start + rows] = array.array('b', [HIDDEN]) * rows
+
+        # Every board can be rebuilt from its seed
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        # Indexes of the mines, of the flagged tiles and of the flagged
+        # tiles without a mine, kept up to date as the game goes on
+        self.mine_indexes = set()
+        self.flag_indexes = set()
+        self.wrong_flags = set()
+        minelist = [self._index(position // rows, position % rows)
+                    for position in self.random.sample(xrange(rows * cols),
+                                                       mines)]
+        self._count_adjacent(minelist)
+
+
+    def _count_adjacent(self, minelist):
+        """Fill in the number of adjacent mines of every tile.
+
+        All mines are put in place first; then every mine adds one to each
+        tile around it which is not a mine itself.  This costs 8 steps per
+        mine, whatever the size of the field.
+        """
+        values = self.values
+        for index in minelist:
+            values[index] = -1
+            self.mine_indexes.add(index)
+        for index in minelist:
+            for offset in self.offsets:
+                if values[index + offset] != -1:
+                    values[index + offset] = values[index + offset] + 1
+
+    def _move_mine(self, old, new):
+        """Move a mine, recounting only the tiles around both places."""
+        values = self.values
+        values[old] = 0
+        for offset in self.offsets:
+            if values[old + offset] == -1:
+                values[old] = values[old] + 1
+            else:
+                values[old + offset] = values[old + offset] - 1
+        for offset in self.offsets:
+            if values[new + offset] != -1:
+                values[new + offset] = values[new + offset] + 1
+        values[new] = -1
+        self.mine_indexes.remove(old)
+        self.mine_indexes.add(new)
+        # A flag put down before the first click may have become wrong
+        if old in self.flag_indexes:
+            self.wrong_flags.add(old)
+        self.wrong_flags.discard(new)
+
+    def _index(self, x, y):
+        """Return the index of the tile at x, y in the flat arrays."""
+        return (x + 1) * self.stride + y + 1
+
+    def _coords(self, index):
+        """Return the x and y coordinates of the tile at an index."""
+        return (index // self.stride - 1, index % self.stride - 1)
+
+    def _neighbours(self, index):
+        """Return the indexes of the tiles adjacent to the tile at index."""
+        states = self.states
+        return [index + offset for offset in self.offsets
+                if states[index + offset] != OUTSIDE]
 
     def _get_adjacent(self, x, y):
         """Provide a list of all tiles adjacent to the given tile.
@@ -355,19 +820,8 @@ class Minefield:
 
         x and y are the x and y coordinates of the base tile, respectively.
         """
-        adjlist = [(x - 1, y - 1), (x, y - 1), (x + 1, y - 1),
-                   (x - 1, y), (x + 1, y),
-                   (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)]
-        rmlist = []
-        for adjpair in adjlist:
-            for value, index in [(-1, 0), (-1, 1), (self.cols, 0),
-                                 (self.rows, 1)]:
-                if adjpair[index] == value:
-                    rmlist.append(adjpair)
-                    break
-        for item in rmlist:
-            adjlist.remove(item)
-        return adjlist
+        return [self._coords(index)
+                for index in self._neighbours(self._index(x, y))]
 
 
     def flag(self, x, y):
@@ -382,22 +836,53 @@ class Minefield:
         x and y are the x and y coordinates of the tile to be flagged,
         respectively.
         """
-        if self.board[x][y][1] == -1:
+        index = self._index(x, y)
+        if self.states[index] == OPENED:
             return -1
-        elif self.board[x][y][1] == 0:
-            self.board[x][y] = (self.board[x][y][0], 1)
+        if self.log is not None:
+            self.log.record(MOVE_FLAG, x, y)
+        self._record(index)
+        if self.states[index] == HIDDEN:
+            self.states[index] = FLAGGED
             self.flags = self.flags + 1
+            self.flag_indexes.add(index)
+            if self.values[index] != -1:
+                self.wrong_flags.add(index)
             return 1
         else:
-            self.board[x][y] = (self.board[x][y][0], 0)
+            self.states[index] = HIDDEN
             self.flags = self.flags - 1
+            self.flag_indexes.remove(index)
+            self.wrong_flags.discard(index)
             return 0
 
+    def _record(self, index):
+        """Add a changed tile to the journal and bump the version."""
+        self.journal.append(index)
+        self.version = self.version + 1
+
+    def changes_since(self, version):
+        """Return a list of the tiles changed after the given version.
+
+        A tile shows up once for every change made to it, in the order the
+        changes were made, as a 2-tuple of its coordinates.
+        """
+        return [self._coords(index) for index in self.journal[version:]]
+
     def is_flagged(self, x, y):
-        return self.board[x][y][1] == 1
+        return self.states[self._index(x, y)] == FLAGGED
 
     def is_uncovered(self, x, y):
-        return self.board[x][y][1] == -1
+        return self.states[self._index(x, y)] == OPENED
+
+    def get_value(self, x, y):
+        """Return the number of mines adjacent to an opened tile.
+
+        For an opened mine, -1 is returned.  The value of a tile which has
+        not been opened yet is not known to the player, and must not be used
+        by a solver.
+        """
+        return self.values[self._index(x, y)]
 
     def get_diff(self):
         """
@@ -406,16 +891,15 @@ class Minefield:
         2-tuple is a 2-tuple, providing the x and y coordinates of a tile;
         the second value of the 2-tuple is either 1 or -1.  1 indicates that
         a mine is at those coordinates; -1 indicates that a mine is not at
-        those coordinates, but a flag was placed there.
+        those coordinates, but a flag was placed there.  The cost depends
+        only on the number of mines and flags, not on the size of the field.
         """
         diff = []
-        for y in range(self.rows):
-            for x in range(self.cols):
-                if self.board[x][y] == (-2, 1):
-                    diff.extend([((x, y), -1)])
-                elif ((self.board[x][y][0] == -1) and
-                      (self.board[x][y][1] == 0)):
-                    diff.extend([((x, y), 1)])
+        for index in sorted(self.wrong_flags):
+            diff.append((self._coords(index), -1))
+        for index in sorted(self.mine_indexes):
+            if self.states[index] == HIDDEN:
+                diff.append((self._coords(index), 1))
         return diff
 
     def open(self, coordlist, y = None):
@@ -437,41 +921,94 @@ class Minefield:
         """
         if y is not None:
             coordlist = [(coordlist, y)]
+        values = self.values
+        states = self.states
+        log = self.log
         opened = []
-        while len(coordlist) != 0:
-            x, y = coordlist.pop()
-            not_done = 1
-            if (self.board[x][y][1] == 1) or (self.board[x][y][0] >= 0):
-                not_done = 0
-            elif self.board[x][y][0] == -1:
+        for x, y in coordlist:
+            index = self._index(x, y)
+            if states[index] != HIDDEN:
+                continue
+            if log is not None:
+                log.record(MOVE_OPEN, x, y)
+            if values[index] == -1:
                 if self.cleared > 0:
-                    self.board[x][y] = (-1, -1)
+                    states[index] = OPENED
+                    self._record(index)
                     opened.append(((x, y), -1))
-                    not_done = 0
+                    continue
                 else:
-                    while self.board[x][y][0] == -1:
-                        # The first opened block is a mine; move it elsewhere.
-                        newx = random.choice(self.freecoords.keys())
-                        newy = random.randrange(len(self.freecoords[newx]))
-                        self.board[x][y] = (-2, 0)
-                        self.board[newx][newy] = (-1,
-                                                  self.board[newx][newy][1])
-            if not_done:
-                adjlist = self._get_adjacent(x, y)
-                adjcount = 0
-                for adjx, adjy in adjlist:
-                    if self.board[adjx][adjy][0] == -1:
-                        adjcount = adjcount + 1
-                self.board[x][y] = (adjcount, -1)
-                if self.cleared is 0:
-                    del self.freecoords
-                    self.start_time = time.time()
-                self.cleared = self.cleared + 1
-                opened.append(((x, y), adjcount))
-                if adjcount == 0:
-                    coordlist.extend(adjlist)
+                    # The first opened block is a mine; move it elsewhere.
+                    while True:
+                        position = self.random.randrange(self.rows * self.cols)
+                        newindex = self._index(position // self.rows,
+                                               position % self.rows)
+                        if values[newindex] != -1:
+                            break
+                    self._move_mine(index, newindex)
+            if self.cleared is 0:
+                self.start_time = time.time()
+            states[index] = OPENED
+            self._record(index)
+            self.cleared = self.cleared + 1
+            opened.append(((x, y), values[index]))
+            if values[index] == 0:
+                self._flood(index, opened)
         return opened
 
+    def apply(self, mines, safe):
+        """Flag and open a batch of tiles in one pass.
+
+        mines holds the coordinates of tiles to flag and safe those of tiles
+        to open.  Tiles which are flagged or opened already are left alone.
+        All the tiles are opened together, as with open(), so cascades which
+        meet are only filled once.
+
+        Returns a 2-tuple (flagged, opened): flagged is a list of the
+        coordinates of the newly flagged tiles, and opened is the list
+        returned by open().
+        """
+        states = self.states
+        flagged = []
+        for x, y in mines:
+            if states[self._index(x, y)] == HIDDEN:
+                self.flag(x, y)
+                flagged.append((x, y))
+        return flagged, self.open(list(safe))
+
+    def _flood(self, start, opened):
+        """Open every tile reachable from start through tiles with no mines
+        around them.
+
+        A tile is opened the moment it is found next to a zero tile, so its
+        state marks it as visited and no tile is ever put on the stack
+        twice.  The opened tiles are appended to opened, in the form used
+        by open().
+        """
+        values = self.values
+        states = self.states
+        offsets = self.offsets
+        journal = self.journal
+        stride = self.stride
+        stack = [start]
+        count = 0
+        while stack:
+            index = stack.pop()
+            for offset in offsets:
+                adjindex = index + offset
+                if states[adjindex] != HIDDEN:
+                    continue
+                states[adjindex] = OPENED
+                journal.append(adjindex)
+                count = count + 1
+                value = values[adjindex]
+                opened.append(((adjindex // stride - 1, adjindex % stride - 1),
+                               value))
+                if value == 0:
+                    stack.append(adjindex)
+        self.cleared = self.cleared + count
+        self.version = self.version + count
+
 
     def open_adjacent(self, x, y):
         """Open all unflagged tiles adjacent to the given one, if appropriate.
@@ -484,20 +1021,44 @@ class Minefield:
         x and y are the x and y coordinates of the tile to be flagged,
         respectively.
         """
-        adjmines = self.board[x][y][0]
-        if self.board[x][y][1] != -1:
+        index = self._index(x, y)
+        adjmines = self.values[index]
+        if self.states[index] != OPENED:
             return []
-        adjlist = self._get_adjacent(x, y)
+        adjlist = self._neighbours(index)
         flagcount = 0
-        for adjx, adjy in adjlist:
-            if self.board[adjx][adjy][1] == 1:
+        for adjindex in adjlist:
+            if self.states[adjindex] == FLAGGED:
                 flagcount = flagcount + 1
         if adjmines == flagcount:
-            return self.open(adjlist)
+            # The tiles opened are left out of the log; replaying the chord
+            # opens them again
+            log = self.log
+            if log is not None:
+                log.record(MOVE_CHORD, x, y)
+            self.log = None
+            try:
+                return self.open([self._coords(adjindex)
+                                  for adjindex in adjlist])
+            finally:
+                self.log = log
         else:
             return []
 
 
+    def record_moves(self, output):
+        """Record every move from now on to a MoveLog on output.
+
+        Opening, flagging and chording are recorded, including the moves a
+        solver applies to the field.  Only a game which has not started yet
+        can be recorded, so that a Replay of the log plays out the same.
+        Returns the MoveLog.
+        """
+        if self.version != 0:
+            raise ValueError, "only a new game can be recorded"
+        self.log = MoveLog(output, self)
+        return self.log
+
     def playtime(self):
         """Return a string representing the current play time.
 
@@ -523,29 +1084,240 @@ class Minefield:
         else:
             return '%i:%i' % (mins, secs)
 
-    def serialize(self):
+    def serialize(self, frontier = False, remaining = False):
         """Returns a normalized, serialized form of the game board.
 
         The serializer is only intended to be used for input into a particular
-        GRINGO application
-        """
-        squares = list()
-        for row in enumerate(self.board):
-            for col in enumerate(self.board[row[0]]):
-                square = col[1]
-                if square[1] == -1:
-                    # This is a safe square
-                    squares.append("safe({0},{1},{2}).".format(row[0],col[0],square[0]))
-                elif square[1] == 1:
-                    # This is a known mine
-                    squares.append("mine({0},{1}).".format(row[0],col[0]))
-
-        return_string = ""
-        for square in squares:
-            return_string += square + "\n"
+        GRINGO application: by default mineBroom, with every known tile.  If
+        frontier is True, only the frontier is written, as the facts of the
+        mineBroomFrontier encoding; remaining adds the count of mines left.
+        """
+        output = cStringIO.StringIO()
+        if frontier:
+            self.write_frontier_facts(output, remaining=remaining)
+        else:
+            self.write_facts(output)
 
         # return everything except the last linebreak
-        return return_string[:-1]
+        return output.getvalue()[:-1]
+
+    def write_facts(self, output, since = 0):
+        """Write the known tiles of the board to a file in ASP form.
+
+        One fact is written per line: safe(x,y,value) for an opened tile and
+        mine(x,y) for a flagged one.  output can be any object with a write
+        method.  If since is given, only the facts for tiles changed after
+        that journal version are written; a tile which was unflagged since
+        then produces no fact at all.  Only the tiles in the journal are
+        visited, not the whole field.
+        """
+        values = self.values
+        states = self.states
+        for index in sorted(set(self.journal[since:])):
+            if states[index] == OPENED:
+                x, y = self._coords(index)
+                # This is a safe square
+                output.write("safe(%i,%i,%i).\n" % (x, y, values[index]))
+            elif states[index] == FLAGGED:
+                x, y = self._coords(index)
+                # This is a known mine
+                output.write("mine(%i,%i).\n" % (x, y))
+
+    def write_frontier_facts(self, output, numbers = None, remaining = False):
+        """Write the frontier of the board to a file in ASP form.
+
+        One fact is written per line, for the mineBroomFrontier encoding:
+        need(x,y,k) for an opened tile next to an unknown tile, where k is
+        its value less the flags around it, and unknown(x,y) for every
+        unknown, unflagged tile next to such a number.  numbers is a list of
+        coordinates of the opened tiles to write; by default it is every
+        opened tile on the board.  If remaining is True, remaining(m) gives
+        the number of mines not flagged yet and outside(k) the number of
+        unknown tiles which are not written.
+        """
+        values = self.values
+        states = self.states
+        if numbers is None:
+            indexes = [index for index in xrange(len(states))
+                       if states[index] == OPENED]
+        else:
+            indexes = sorted([self._index(x, y) for x, y in numbers])
+
+        unknown = set()
+        for index in indexes:
+            around = []
+            flagged = 0
+            for adjacent in self._neighbours(index):
+                if states[adjacent] == HIDDEN:
+                    around.append(adjacent)
+                elif states[adjacent] == FLAGGED:
+                    flagged = flagged + 1
+            if around:
+                x, y = self._coords(index)
+                output.write("need(%i,%i,%i).\n" % (x, y,
+                                                     values[index] - flagged))
+                unknown.update(around)
+        for index in sorted(unknown):
+            output.write("unknown(%i,%i).\n" % self._coords(index))
+        if remaining:
+            hidden = self.rows * self.cols - self.cleared - self.flags
+            output.write("remaining(%i).\n" % (self.mines - self.flags))
+            output.write("outside(%i).\n" % (hidden - len(unknown)))
+
+    def copy(self):
+        """Return a copy of the field which can be played independently.
+
+        The journal is copied as well, so changes_since() gives the same
+        answers on both until one of them is changed.
+        """
+        field = copy.copy(self)
+        # Moves on the copy are its own; they are not recorded
+        field.log = None
+        field.values = array.array('b', self.values)
+        field.states = array.array('b', self.states)
+        field.journal = array.array('l', self.journal)
+        field.mine_indexes = set(self.mine_indexes)
+        field.flag_indexes = set(self.flag_indexes)
+        field.wrong_flags = set(self.wrong_flags)
+        field.random = random.Random()
+        field.random.setstate(self.random.getstate())
+        return field
+
+    def _plane(self, source, value):
+        """Return a string of '0' and '1' characters, one per tile.
+
+        A tile gets a '1' if its byte in source, either values or states,
+        equals value.  The tiles are in column order, border left out.
+        """
+        table = ['0'] * 256
+        table[value & 0xff] = '1'
+        table = ''.join(table)
+        columns = []
+        for x in range(self.cols):
+            start = self._index(x, 0)
+            columns.append(source[start:start + self.rows].tostring())
+        return ''.join(columns).translate(table)
+
+    def snapshot(self):
+        """Return a compact binary snapshot of the board.
+
+        The snapshot is a header with the size, mine count and seed,
+        followed by three bit-packed planes with one bit per tile: mines,
+        opened tiles and flagged tiles.  Two boards are in the same state
+        exactly when their snapshots are equal.  Use from_snapshot() to
+        load one.
+        """
+        planes = [self._plane(self.values, -1),
+                  self._plane(self.states, OPENED),
+                  self._plane(self.states, FLAGGED)]
+        padding = '0' * (-(self.rows * self.cols) % 8)
+        header = struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, self.rows,
+                             self.cols, self.mines, self.seed)
+        packed = [header]
+        for plane in planes:
+            plane = plane + padding
+            packed.append(binascii.unhexlify('%0*x' % (len(plane) // 4,
+                                                       int(plane, 2))))
+        return ''.join(packed)
+
+    def from_snapshot(cls, data):
+        """Create a Minefield from a snapshot made by snapshot().
+
+        The adjacent-mine counts are recounted from the mine plane and the
+        other arrays are filled in straight from the planes.  Every opened
+        or flagged tile is entered into the journal, so a solver picks the
+        whole board up as changed.
+        """
+        offset = struct.calcsize(SNAPSHOT_HEADER)
+        magic, rows, cols, mines, seed = struct.unpack(SNAPSHOT_HEADER,
+                                                       data[:offset])
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError, "not a minefield snapshot"
+        tiles = rows * cols
+        length = (tiles + 7) // 8
+        planes = []
+        for i in range(3):
+            packed = data[offset + i * length:offset + (i + 1) * length]
+            if len(packed) != length:
+                raise ValueError, "truncated minefield snapshot"
+            number = int(binascii.hexlify(packed), 16)
+            planes.append(format(number, '0%ib' % (length * 8))[:tiles])
+
+        # No mines are placed at random; the ones of the snapshot are put
+        # straight in
+        minefield = cls(rows, cols, 0, seed)
+        minefield.mines = mines
+        if '1' not in planes[1]:
+            # A mine under the first click is moved with the random number
+            # generator as it is after placing the mines, as on the board the
+            # snapshot was taken of
+            minefield.random.sample(xrange(tiles), mines)
+        stride = minefield.stride
+        values = minefield.values
+        states = minefield.states
+        minefield._count_adjacent([(position // rows + 1) * stride +
+                                   position % rows + 1
+                                   for position in _ones(planes[0])])
+
+        # The opened tiles are copied into the states a column at a time
+        table = ['\x00'] * 256
+        table[ord('1')] = chr(OPENED & 0xff)
+        table = ''.join(table)
+        for x in range(cols):
+            start = minefield._index(x, 0)
+            states[start:start + rows] = array.array(
+                'b', planes[1][x * rows:(x + 1) * rows].translate(table))
+        # Their indexes are picked out of the states without a loop over
+        # the tiles in Python
+        table = ['\x00'] * 256
+        table[OPENED & 0xff] = '\x01'
+        table = ''.join(table)
+        opened = array.array('l', itertools.compress(
+            xrange(len(states)), bytearray(states.tostring().translate(table))))
+        flagged = array.array('l', [(position // rows + 1) * stride +
+                                    position % rows + 1
+                                    for position in _ones(planes[2])])
+        for index in flagged:
+            states[index] = FLAGGED
+            if values[index] != -1:
+                minefield.wrong_flags.add(index)
+        minefield.flag_indexes = set(flagged)
+        minefield.flags = len(flagged)
+        minefield.cleared = len(opened) - len([index for index
+                                               in minefield.mine_indexes
+                                               if states[index] == OPENED])
+        minefield.journal = opened + flagged
+        minefield.version = len(minefield.journal)
+        return minefield
+    from_snapshot = classmethod(from_snapshot)
+
+    def from_facts(cls, text, rows, cols):
+        """Create a Minefield from facts in the form written by serialize().
+
+        Only what the facts tell is known: the opened tiles with their
+        numbers, and the flags, which are taken to be the only mines.  The
+        result is fit for handing to a solver, not for playing on.  Lines
+        starting with % are comments.
+        """
+        minefield = cls(rows, cols, 0, 0)
+        text = re.sub(r'%.*', '', text)
+        for name, arguments in re.findall(r'(safe|mine)\(([-\d, ]+)\)', text):
+            numbers = [int(argument) for argument in arguments.split(',')]
+            index = minefield._index(numbers[0], numbers[1])
+            if name == 'safe':
+                minefield.values[index] = numbers[2]
+                minefield.states[index] = OPENED
+                minefield.cleared = minefield.cleared + 1
+            else:
+                minefield.values[index] = -1
+                minefield.states[index] = FLAGGED
+                minefield.mines = minefield.mines + 1
+                minefield.flags = minefield.flags + 1
+                minefield.mine_indexes.add(index)
+                minefield.flag_indexes.add(index)
+            minefield._record(index)
+        return minefield
+    from_facts = classmethod(from_facts)
 
     def won(self):
         """Indicate whether or not the game has been won.
@@ -556,6 +1328,750 @@ class Minefield:
         return ((self.flags == self.mines) and
                 (self.cleared == (self.rows * self.cols) - self.mines))
 
+# Chunked fields are made of square chunks of this many tiles a side
+CHUNK_SIZE = 32
+
+def _unfold(number):
+    """Map an integer to a natural number, keeping distinct ones distinct."""
+    if number < 0:
+        return -2 * number - 1
+    return 2 * number
+
+class ChunkedMinefield(Minefield):
+    """Provide a playing field which is only generated where it is played.
+
+    The field is cut into square chunks of CHUNK_SIZE tiles a side.  The
+    mines of a chunk are placed the first time a tile in or next to it is
+    looked at, from a random number generator seeded with the seed of the
+    field and the coordinates of the chunk, so the same seed always gives
+    the same field whatever order it is explored in.  Every tile is a mine
+    with the same chance, the density; each chunk holds the number of
+    mines closest to the density times its size.
+
+    The state of a chunk is only stored once one of its tiles is opened or
+    flagged, so the memory used grows with the explored area alone.  rows
+    or cols, or both, may be None for a field without bounds in that
+    direction, with negative coordinates as well; such a field has no
+    mine count and can never be won.
+    """
+    def __init__(self, rows = None, cols = None, density = .15625,
+                 seed = None):
+        """Initialize the playing field.
+
+        No mines are placed here; see the class documentation.  The first
+        tile opened is never a mine.
+        """
+        for var in (rows, cols):
+            if var is not None and var <= 0:
+                raise ValueError, "rows and cols must be > 0"
+        if not 0 <= density < 1:
+            raise ValueError, "density must be at least 0 and below 1"
+
+        self.rows = rows
+        self.cols = cols
+        self.density = density
+        self.cleared = 0
+        self.flags = 0
+        self.start_time = None
+        # The coordinates of every opened, flagged or unflagged tile are
+        # appended to the journal
+        self.journal = []
+        self.version = 0
+
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        # The tile opened first, which is kept free of mines
+        self.first = None
+        # The states of the chunks which have been played, by chunk
+        # coordinates, and the mines of the chunks which have been looked at
+        self.chunks = {}
+        self.chunk_mines = {}
+        self.flagged = set()
+        self.mines = self._count_mines()
+
+    def _span(self, chunk, size):
+        """Return how many tiles of a chunk row or column are on the field."""
+        if size is None:
+            return CHUNK_SIZE
+        if chunk < 0:
+            return 0
+        return max(0, min(CHUNK_SIZE, size - chunk * CHUNK_SIZE))
+
+    def _chunk_count(self, cx, cy, tiles):
+        """Return the number of mines of a chunk with the given number of
+        tiles on the field."""
+        count = int(round(self.density * tiles))
+        if self.first is not None and (self.first[0] // CHUNK_SIZE,
+                                       self.first[1] // CHUNK_SIZE) == (cx, cy):
+            count = min(count, tiles - 1)
+        return count
+
+    def _count_mines(self):
+        """Return the number of mines on the field, or None without bounds.
+
+        Chunks only come in four sizes, whole ones and those cut off by the
+        last column, the last row or both, so this takes constant time.
+        """
+        if self.rows is None or self.cols is None:
+            return None
+        total = 0
+        for width, columns in ((CHUNK_SIZE, self.cols // CHUNK_SIZE),
+                               (self.cols % CHUNK_SIZE, 1)):
+            for height, rows in ((CHUNK_SIZE, self.rows // CHUNK_SIZE),
+                                 (self.rows % CHUNK_SIZE, 1)):
+                total = total + (columns * rows *
+                                 int(round(self.density * width * height)))
+        if self.first is not None:
+            # The chunk of the first tile may hold one mine less
+            cx, cy = self.first[0] // CHUNK_SIZE, self.first[1] // CHUNK_SIZE
+            tiles = (self._span(cx, self.cols) * self._span(cy, self.rows))
+            total = (total - int(round(self.density * tiles)) +
+                     self._chunk_count(cx, cy, tiles))
+        return total
+
+    def _mines(self, cx, cy):
+        """Return the set of the coordinates of the mines in a chunk.
+
+        The mines are placed the first time a chunk is asked for, and kept.
+        """
+        key = (cx, cy)
+        if key not in self.chunk_mines:
+            width = self._span(cx, self.cols)
+            height = self._span(cy, self.rows)
+            left = cx * CHUNK_SIZE
+            top = cy * CHUNK_SIZE
+            tiles = [(left + position // height, top + position % height)
+                     for position in xrange(width * height)]
+            if self.first in tiles:
+                tiles.remove(self.first)
+            generator = random.Random(((_unfold(cy) << 64 | _unfold(cx)) << 64)
+                                      | self.seed)
+            self.chunk_mines[key] = frozenset(generator.sample(
+                tiles, self._chunk_count(cx, cy, width * height)))
+        return self.chunk_mines[key]
+
+    def _is_mine(self, x, y):
+        return (x, y) in self._mines(x // CHUNK_SIZE, y // CHUNK_SIZE)
+
+    def _inside(self, x, y):
+        """Indicate whether a tile is on the field."""
+        return ((self.cols is None or 0 <= x < self.cols) and
+                (self.rows is None or 0 <= y < self.rows))
+
+    def _state(self, x, y):
+        """Return the state of a tile; untouched chunks are all HIDDEN."""
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return HIDDEN
+        return chunk[(x % CHUNK_SIZE) * CHUNK_SIZE + y % CHUNK_SIZE]
+
+    def _set_state(self, x, y, state):
+        """Set the state of a tile, storing its chunk if it was untouched."""
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = array.array('b', [HIDDEN]) * (CHUNK_SIZE * CHUNK_SIZE)
+            self.chunks[key] = chunk
+        chunk[(x % CHUNK_SIZE) * CHUNK_SIZE + y % CHUNK_SIZE] = state
+
+    def _get_adjacent(self, x, y):
+        """Provide a list of the coordinates of all tiles adjacent to the
+        given tile which are on the field."""
+        return [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if (dx or dy) and self._inside(x + dx, y + dy)]
+
+    def flag(self, x, y):
+        """Flag or unflag an unopened tile, as Minefield.flag() does."""
+        state = self._state(x, y)
+        if state == OPENED:
+            return -1
+        self._record((x, y))
+        if state == HIDDEN:
+            self._set_state(x, y, FLAGGED)
+            self.flags = self.flags + 1
+            self.flagged.add((x, y))
+            return 1
+        else:
+            self._set_state(x, y, HIDDEN)
+            self.flags = self.flags - 1
+            self.flagged.remove((x, y))
+            return 0
+
+    def _record(self, coords):
+        """Add a changed tile to the journal and bump the version."""
+        self.journal.append(coords)
+        self.version = self.version + 1
+
+    def changes_since(self, version):
+        return self.journal[version:]
+
+    def is_flagged(self, x, y):
+        return self._state(x, y) == FLAGGED
+
+    def is_uncovered(self, x, y):
+        return self._state(x, y) == OPENED
+
+    def get_value(self, x, y):
+        """Return the number of mines adjacent to an opened tile, or -1 for
+        a mine, as Minefield.get_value() does."""
+        if self._is_mine(x, y):
+            return -1
+        count = 0
+        for adjx, adjy in self._get_adjacent(x, y):
+            if self._is_mine(adjx, adjy):
+                count = count + 1
+        return count
+
+    def get_diff(self):
+        """Return a list of mine locations, as Minefield.get_diff() does.
+
+        Only the mines of the chunks which have been looked at are listed,
+        the ones in and around the explored area; the others have not been
+        placed, and placing them would cost time in the size of the field.
+        """
+        diff = []
+        for coords in sorted(self.flagged):
+            if not self._is_mine(*coords):
+                diff.append((coords, -1))
+        mines = set()
+        for chunk in self.chunk_mines.values():
+            mines.update(chunk)
+        for coords in sorted(mines):
+            if self._state(*coords) == HIDDEN:
+                diff.append((coords, 1))
+        return diff
+
+    def open(self, coordlist, y = None):
+        """Open one or more tiles, as Minefield.open() does.
+
+        Cascades carry on across chunks, placing the mines of every chunk
+        they come next to.
+        """
+        if y is not None:
+            coordlist = [(coordlist, y)]
+        opened = []
+        for x, y in coordlist:
+            if not self._inside(x, y) or self._state(x, y) != HIDDEN:
+                continue
+            if self.first is None:
+                # Mines placed before now may be on the first tile; place
+                # them again without it
+                self.first = (x, y)
+                self.chunk_mines = {}
+                self.mines = self._count_mines()
+                self.start_time = time.time()
+            self._set_state(x, y, OPENED)
+            self._record((x, y))
+            value = self.get_value(x, y)
+            opened.append(((x, y), value))
+            if value == -1:
+                continue
+            self.cleared = self.cleared + 1
+            if value == 0:
+                self._flood((x, y), opened)
+        return opened
+
+    def _flood(self, start, opened):
+        """Open every tile reachable from start through tiles with no mines
+        around them, as Minefield._flood() does."""
+        stack = [start]
+        count = 0
+        while stack:
+            x, y = stack.pop()
+            for coords in self._get_adjacent(x, y):
+                if self._state(*coords) != HIDDEN:
+                    continue
+                self._set_state(coords[0], coords[1], OPENED)
+                self.journal.append(coords)
+                count = count + 1
+                value = self.get_value(*coords)
+                opened.append((coords, value))
+                if value == 0:
+                    stack.append(coords)
+        self.cleared = self.cleared + count
+        self.version = self.version + count
+
+    def apply(self, mines, safe):
+        """Flag and open a batch of tiles, as Minefield.apply() does."""
+        flagged = []
+        for x, y in mines:
+            if self._state(x, y) == HIDDEN:
+                self.flag(x, y)
+                flagged.append((x, y))
+        return flagged, self.open(list(safe))
+
+    def open_adjacent(self, x, y):
+        """Open all unflagged tiles adjacent to the given one, if the flags
+        around it match its number, as Minefield.open_adjacent() does."""
+        if self._state(x, y) != OPENED:
+            return []
+        adjlist = self._get_adjacent(x, y)
+        flagcount = len([coords for coords in adjlist
+                         if self._state(*coords) == FLAGGED])
+        if self.get_value(x, y) == flagcount:
+            return self.open(adjlist)
+        else:
+            return []
+
+    def write_facts(self, output, since = 0):
+        """Write the known tiles of the board in ASP form, as
+        Minefield.write_facts() does."""
+        for x, y in sorted(set(self.journal[since:])):
+            state = self._state(x, y)
+            if state == OPENED:
+                output.write("safe(%i,%i,%i).\n" % (x, y, self.get_value(x, y)))
+            elif state == FLAGGED:
+                output.write("mine(%i,%i).\n" % (x, y))
+
+    def write_frontier_facts(self, output, numbers = None, remaining = False):
+        """Write the frontier of the board in ASP form, as
+        Minefield.write_frontier_facts() does.
+
+        The opened tiles are found through the journal.  Without bounds
+        there is no count of mines left, so remaining is ignored.
+        """
+        if numbers is None:
+            numbers = [coords for coords in set(self.journal)
+                       if self._state(*coords) == OPENED]
+        unknown = set()
+        for x, y in sorted(numbers):
+            around = []
+            flagged = 0
+            for coords in self._get_adjacent(x, y):
+                state = self._state(*coords)
+                if state == HIDDEN:
+                    around.append(coords)
+                elif state == FLAGGED:
+                    flagged = flagged + 1
+            if around:
+                output.write("need(%i,%i,%i).\n" % (x, y, self.get_value(x, y)
+                                                     - flagged))
+                unknown.update(around)
+        for coords in sorted(unknown):
+            output.write("unknown(%i,%i).\n" % coords)
+        if remaining and self.mines is not None:
+            hidden = self.rows * self.cols - self.cleared - self.flags
+            output.write("remaining(%i).\n" % (self.mines - self.flags))
+            output.write("outside(%i).\n" % (hidden - len(unknown)))
+
+    def copy(self):
+        """Return a copy of the field which can be played independently."""
+        field = copy.copy(self)
+        field.journal = list(self.journal)
+        field.chunks = dict([(key, array.array('b', chunk))
+                             for key, chunk in self.chunks.items()])
+        field.chunk_mines = dict(self.chunk_mines)
+        field.flagged = set(self.flagged)
+        return field
+
+    def snapshot(self):
+        raise ValueError, "chunked fields have no snapshots"
+
+    def record_moves(self, output):
+        raise ValueError, "moves on chunked fields can not be recorded"
+
+    def won(self):
+        """Indicate whether or not the game has been won; a field without
+        bounds never is."""
+        if self.mines is None:
+            return False
+        return ((self.flags == self.mines) and
+                (self.cleared == (self.rows * self.cols) - self.mines))
+
+def _read_varint(data, position):
+    """Read a number packed by _varint() from data at position.
+
+    Returns a 2-tuple of the number and the position after it; raises
+    IndexError if data ends first.
+    """
+    number = 0
+    shift = 0
+    while True:
+        byte = ord(data[position])
+        number = number | (byte & 0x7f) << shift
+        position = position + 1
+        if byte < 0x80:
+            return number, position
+        shift = shift + 7
+
+def play_move(minefield, move, x, y):
+    """Make a move as recorded by a MoveLog on minefield.
+
+    Returns the list of opened tiles, as open() does; flagging a tile opens
+    none.
+    """
+    if move == MOVE_OPEN:
+        return minefield.open(x, y)
+    elif move == MOVE_FLAG:
+        minefield.flag(x, y)
+        return []
+    else:
+        return minefield.open_adjacent(x, y)
+
+class Replay:
+    """Play a log written by a MoveLog back, without a window.
+
+    The moves are read once, into the moves attribute, as 3-tuples of the
+    kind of move and its coordinates.  field() plays them on a new Minefield
+    as fast as it can.  Every interval moves a snapshot of the field is
+    kept, so that going to a point of the game once more starts from the
+    last snapshot before it instead of the first move; an interval of None
+    keeps no snapshots.  The snapshots can be saved with save_snapshots()
+    and taken up again by another Replay of the same log, or of a longer
+    one it grew into, with load_snapshots().
+    """
+    def __init__(self, data, interval = REPLAY_INTERVAL):
+        """Read a move log from the string data.
+
+        A move cut short at the end of the log, as left by a crash, is left
+        out.
+        """
+        offset = struct.calcsize(SNAPSHOT_HEADER)
+        if len(data) < offset:
+            raise ValueError, "truncated move log"
+        magic, rows, cols, mines, seed = struct.unpack(SNAPSHOT_HEADER,
+                                                       data[:offset])
+        if magic != MOVE_LOG_MAGIC:
+            raise ValueError, "not a move log"
+        self.data = data
+        self.rows = rows
+        self.cols = cols
+        self.mines = mines
+        self.seed = seed
+        self.interval = interval
+        # Snapshots of the field by the number of moves made before them
+        self.snapshots = {}
+        self.moves = []
+        position = offset
+        try:
+            while position < len(data):
+                move = ord(data[position])
+                if move >= len(MOVE_NAMES):
+                    raise ValueError, "bad move in move log"
+                x, end = _read_varint(data, position + 1)
+                y, end = _read_varint(data, end)
+                self.moves.append((move, x, y))
+                position = end
+        except IndexError:
+            pass
+
+    def field(self, moves = None):
+        """Return a Minefield as it was after the given number of moves.
+
+        By default every move is made.  The field is a new one every time,
+        which can be played on; it is not recorded.
+        """
+        if moves is None or moves > len(self.moves):
+            moves = len(self.moves)
+        start = max([0] + [count for count in self.snapshots
+                           if count <= moves])
+        if start:
+            minefield = Minefield.from_snapshot(self.snapshots[start])
+        else:
+            minefield = Minefield(self.rows, self.cols, self.mines, self.seed)
+        interval = self.interval
+        for count in xrange(start, moves):
+            if (interval and count and count % interval == 0 and
+                    count not in self.snapshots):
+                self.snapshots[count] = minefield.snapshot()
+            play_move(minefield, *self.moves[count])
+        return minefield
+
+    def save_snapshots(self, output):
+        """Write the snapshots kept so far to a file.
+
+        output can be any object with a write method.  The length and the
+        CRC-32 of the move log come first, so that the snapshots are only
+        ever used with the log they were taken from.
+        """
+        output.write(struct.pack(SNAPSHOTS_HEADER, SNAPSHOTS_MAGIC,
+                                 len(self.data),
+                                 binascii.crc32(self.data) & 0xffffffff))
+        for count in sorted(self.snapshots):
+            snapshot = self.snapshots[count]
+            output.write(struct.pack(SNAPSHOTS_ENTRY, count, len(snapshot)))
+            output.write(snapshot)
+
+    def load_snapshots(self, data):
+        """Take up the snapshots written by save_snapshots() to data.
+
+        They are only taken up if this log starts with the one they were
+        taken from; a log is only ever appended to, so the moves before
+        them are the same.  Returns the number of snapshots taken up.
+        """
+        offset = struct.calcsize(SNAPSHOTS_HEADER)
+        if len(data) < offset:
+            return 0
+        magic, length, checksum = struct.unpack(SNAPSHOTS_HEADER,
+                                                data[:offset])
+        if (magic != SNAPSHOTS_MAGIC or length > len(self.data) or
+                binascii.crc32(self.data[:length]) & 0xffffffff != checksum):
+            return 0
+        entry = struct.calcsize(SNAPSHOTS_ENTRY)
+        loaded = 0
+        while offset + entry <= len(data):
+            count, size = struct.unpack(SNAPSHOTS_ENTRY,
+                                        data[offset:offset + entry])
+            offset = offset + entry
+            snapshot = data[offset:offset + size]
+            offset = offset + size
+            if len(snapshot) < size:
+                break
+            self.snapshots[count] = snapshot
+            loaded = loaded + 1
+        return loaded
+
+def new_minefield(rows, cols, mines, seed = None):
+    """Return a Minefield, or a ChunkedMinefield with the same share of
+    mines if the --chunked option is given."""
+    if chunked:
+        return ChunkedMinefield(rows, cols, float(mines) / (rows * cols), seed)
+    return Minefield(rows, cols, mines, seed)
+
+def play_headless(rows, cols, mines, seed, backend_name, guess = True,
+                  profile = False, parallel = False, learn = False,
+                  chunked = False, record = None, use_cache = True):
+    """Play one game with the solver alone and return its results.
+
+    The first click goes to the middle of the field.  Whenever the solver
+    is stuck, the unknown tile least likely to be a mine is opened if guess
+    is true; otherwise the game ends there.  Returns a dict with the seed, whether the game was
+    won, lost or got stuck at least once, the number of guesses after the
+    first click, the number of solver iterations and the time spent in the
+    solver, in seconds.  If profile is true, the game as recorded by a
+    SolverStats is added as well.  If parallel is true, large frontiers
+    are solved in a process pool with one process per core.
+
+    The hits and misses of the pattern cache during the game are counted;
+    if learn is true, the patterns added to it are returned too.  If
+    use_cache is false, the cache is left alone and every component the
+    local rules do not settle goes to the backend.  If
+    chunked is true, the game is played on a ChunkedMinefield.  If record
+    is given, the moves of the game are recorded to a move log of that
+    name.
+    """
+    if chunked:
+        minefield = ChunkedMinefield(rows, cols, float(mines) / (rows * cols),
+                                     seed)
+    else:
+        minefield = Minefield(rows, cols, mines, seed)
+    stats = None
+    if profile:
+        stats = solvers.SolverStats()
+        stats.new_game(rows=rows, cols=cols, mines=mines,
+                       seed=minefield.seed)
+    solver = solvers.get_backend(backend_name, stats=stats)
+    result = {'seed': minefield.seed, 'won': False, 'lost': False,
+              'stuck': False, 'guesses': 0, 'iterations': 0,
+              'solve_time': 0.0}
+    if stats is not None:
+        result['profile'] = stats.game
+    result['cache_hits'] = 0
+    result['cache_misses'] = 0
+    cache = None
+    if use_cache:
+        cache = solvers.pattern_cache
+        hits = cache.hits
+        misses = cache.misses
+        if learn:
+            cache.added = {}
+            result['patterns'] = cache.added
+
+    log_file = None
+    if record is not None:
+        log_file = open(record, 'wb')
+        minefield.record_moves(log_file)
+
+    try:
+        opened = minefield.open(cols // 2, rows // 2)
+        solved_version = 0
+        while True:
+            if [value for coords, value in opened if value < 0]:
+                result['lost'] = True
+                return result
+            # Mines cut off from every number are never flagged by the
+            # solver, so only count the opened tiles here
+            if minefield.cleared == rows * cols - minefield.mines:
+                result['won'] = True
+                return result
+
+            opened = []
+            changes = minefield.changes_since(solved_version)
+            solved_version = minefield.version
+            if changes:
+                start = time.time()
+                found_mines, safe = solvers.deduce(minefield, solver, changes,
+                                                   parallel=parallel,
+                                                   cache=cache)
+                result['solve_time'] = (result['solve_time'] + time.time() -
+                                        start)
+                if cache is not None:
+                    result['cache_hits'] = cache.hits - hits
+                    result['cache_misses'] = cache.misses - misses
+                result['iterations'] = result['iterations'] + 1
+                start = time.time()
+                flagged, opened = minefield.apply(found_mines, safe)
+                if stats is not None:
+                    stats.add('apply', time.time() - start)
+
+            if minefield.version == solved_version:
+                # Nothing changed, so the solver is stuck
+                result['stuck'] = True
+                if not guess:
+                    return result
+                start = time.time()
+                best = solvers.best_guess(minefield)
+                result['solve_time'] = (result['solve_time'] + time.time() -
+                                        start)
+                if best is None:
+                    return result
+                (x, y), probability = best
+                result['guesses'] = result['guesses'] + 1
+                opened = minefield.open(x, y)
+    finally:
+        if log_file is not None:
+            log_file.close()
+
+def _play_headless(arguments):
+    """Unpack a tuple of arguments for play_headless() in a worker process"""
+    return play_headless(*arguments)
+
+def run_batch(game_opts):
+    """Play a batch of games without a window and print the results.
+
+    The games are spread over a pool of worker processes, one per core
+    unless game_opts holds a 'jobs' count.  With a single job, the games
+    are played one after another and the frontier of each is spread over
+    the cores instead.  Game i is played with the seed
+    given by --seed plus i, or with a random seed.  With --record, the
+    moves of every game are recorded to a log named after its seed.
+    """
+    import multiprocessing
+
+    games = game_opts['batch']
+    jobs = game_opts.get('jobs', multiprocessing.cpu_count())
+    if game_opts.has_key('seed'):
+        first_seed = game_opts['seed']
+    else:
+        first_seed = random.getrandbits(32)
+    arguments = [(game_opts['rows'], game_opts['cols'], game_opts['mines'],
+                  first_seed + game, backend, game_opts['guess'],
+                  profile is not None, jobs == 1, cache_path is not None,
+                  chunked, record_name(first_seed + game), use_cache)
+                 for game in range(games)]
+    if cache_path is not None:
+        # Loaded before the pool is made, so every worker starts with it
+        solvers.pattern_cache.load(cache_path)
+
+    start = time.time()
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.map(_play_headless, arguments)
+        pool.close()
+        pool.join()
+    else:
+        results = map(_play_headless, arguments)
+    elapsed = time.time() - start
+
+    if(verbose):
+        print "%12s %5s %5s %6s %8s %11s" % ("seed", "won", "stuck", "guess",
+                                             "solves", "solve time")
+        for result in results:
+            print "%12i %5i %5i %6i %8i %11.4f" % (result['seed'],
+                                                   result['won'],
+                                                   result['stuck'],
+                                                   result['guesses'],
+                                                   result['iterations'],
+                                                   result['solve_time'])
+    solve_times = [result['solve_time'] for result in results]
+    print "Games:            %i (%ix%i, %i mines, %s backend)" % (
+        games, game_opts['rows'], game_opts['cols'], game_opts['mines'],
+        backend)
+    print "Win rate:         %.1f%%" % (100.0 * len([r for r in results
+                                                     if r['won']]) / games)
+    print "Stuck rate:       %.1f%%" % (100.0 * len([r for r in results
+                                                     if r['stuck']]) / games)
+    print "Guesses per game: %.2f" % (float(sum([r['guesses']
+                                                 for r in results])) / games)
+    print "Solve time:       %.4fs mean, %.4fs max per game" % (
+        sum(solve_times) / games, max(solve_times))
+    print "Wall time:        %.2fs on %i processes" % (elapsed, jobs)
+    if use_cache:
+        print "Pattern cache:    %i hits, %i misses" % (
+            sum([r['cache_hits'] for r in results]),
+            sum([r['cache_misses'] for r in results]))
+    else:
+        print "Pattern cache:    off"
+    if cache_path is not None:
+        for result in results:
+            solvers.pattern_cache.update(result['patterns'])
+        solvers.pattern_cache.save(cache_path)
+    if profile is not None:
+        stats = solvers.SolverStats()
+        stats.games = [result['profile'] for result in results]
+        write_profile(stats)
+
+def record_name(seed):
+    """Return the name of the move log of the game with the given seed in
+    a batch, or None if the moves are not recorded."""
+    if record_path is None:
+        return None
+    return "%s.%i" % (record_path, seed)
+
+def run_replay(game_opts):
+    """Play a move log back without a window and print the result.
+
+    All moves are made, or the first game_opts['moves'] of them.  With
+    --print, every move is listed first.  The snapshots taken on the way
+    are kept next to the log, in a file with ".snapshots" added to its
+    name, so that going to a later move of the same log the next time
+    starts from the last one before it.
+    """
+    f = open(game_opts['replay'], 'rb')
+    data = f.read()
+    f.close()
+    try:
+        replay = Replay(data)
+    except ValueError:
+        show_usage("Bad move log %s (%s)" % (game_opts['replay'],
+                                              sys.exc_info()[1]))
+    snapshots_path = game_opts['replay'] + '.snapshots'
+    if os.path.exists(snapshots_path):
+        f = open(snapshots_path, 'rb')
+        replay.load_snapshots(f.read())
+        f.close()
+    saved = len(replay.snapshots)
+    moves = min(game_opts.get('moves', len(replay.moves)), len(replay.moves))
+    if(verbose):
+        for number, (move, x, y) in enumerate(replay.moves[:moves]):
+            print "%8i %-5s %i,%i" % (number + 1, MOVE_NAMES[move], x, y)
+    start = time.time()
+    minefield = replay.field(moves)
+    elapsed = time.time() - start
+    if len(replay.snapshots) > saved:
+        f = open(snapshots_path, 'wb')
+        replay.save_snapshots(f)
+        f.close()
+
+    lost = len([index for index in minefield.mine_indexes
+                if minefield.states[index] == OPENED]) > 0
+    print "Game:             %ix%i, %i mines, seed %i" % (
+        replay.rows, replay.cols, replay.mines, replay.seed)
+    print "Moves:            %i of %i (%i bytes)" % (moves, len(replay.moves),
+                                                     len(data))
+    print "Replay time:      %.4fs (%.0f moves/s)" % (
+        elapsed, moves / max(elapsed, 1e-9))
+    print "Opened:           %i of %i safe tiles, %i flags" % (
+        minefield.cleared, replay.rows * replay.cols - replay.mines,
+        minefield.flags)
+    if lost:
+        print "Result:           lost"
+    elif minefield.cleared == replay.rows * replay.cols - replay.mines:
+        print "Result:           won"
+    else:
+        print "Result:           not finished"
+
 def get_options():
     """Parse command-line options.
 
@@ -564,7 +2080,8 @@ def get_options():
     values.  It will abort the program if appropriate; for example, if
     an option has a bad argument, or a bad option is given.
     """
-    game_opts = {'rows': 16, 'cols': 16, 'mines': 40, 'debug': 0, 'solve': False}
+    game_opts = {'rows': 16, 'cols': 16, 'mines': 40, 'debug': 0, 'solve': False,
+                 'guess': True}
     if os.name is 'posix':
         game_opts['paths'] = ['/usr/share/games/pysweeper',
                               '/usr/local/share/games/pysweeper', sys.path[0],
@@ -573,9 +2090,12 @@ def get_options():
         game_opts['paths'] = [sys.path[0], '.']
 
     try:
-        options = getopt.getopt(sys.argv[1:], 'hvdr:c:m:slvp',
+        options = getopt.getopt(sys.argv[1:], 'hvdr:c:m:slvpb:',
                                 ['help', 'rows=', 'columns=', 'cols=', 'dir=',
-                                 'mines=', 'version', 'debug','solve','limit','verbose','print'])[0]
+                                 'mines=', 'version', 'debug','solve','limit','verbose','print',
+                                 'backend=', 'seed=', 'batch=', 'jobs=', 'no-guess',
+                                 'profile=', 'cache=', 'no-cache', 'chunked',
+                                 'record=', 'replay=', 'moves='])[0]
     except getopt.error:
         show_usage(sys.exc_info()[1])
 
@@ -606,6 +2126,40 @@ def get_options():
         elif option in ('-p', '--print'):
             global verbose
             verbose = True
+        elif option in ('-b', '--backend'):
+            if argument not in solvers.backends:
+                show_usage("Unknown solver backend (%s)" % argument)
+            global backend
+            backend = argument
+        elif option == '--seed':
+            set_option(game_opts, 'seed', argument, -1)
+        elif option == '--batch':
+            set_option(game_opts, 'batch', argument)
+        elif option == '--jobs':
+            set_option(game_opts, 'jobs', argument)
+        elif option == '--no-guess':
+            global guess
+            guess = False
+            game_opts['guess'] = False
+        elif option == '--profile':
+            global profile
+            profile = argument
+        elif option == '--cache':
+            global cache_path
+            cache_path = argument
+        elif option == '--no-cache':
+            global use_cache
+            use_cache = False
+        elif option == '--chunked':
+            global chunked
+            chunked = True
+        elif option == '--record':
+            global record_path
+            record_path = argument
+        elif option == '--replay':
+            game_opts['replay'] = argument
+        elif option == '--moves':
+            set_option(game_opts, 'moves', argument, -1)
         elif option == '--dir':
             argument = os.path.normcase(argument)
             argument = os.path.normpath(argument)
@@ -613,6 +2167,10 @@ def get_options():
     if set_size and (not set_mines):
         game_opts['mines'] = int(round(game_opts['rows'] * game_opts['cols']
                                        * .15625))
+    if chunked and record_path is not None:
+        show_usage("Moves on a chunked field can not be recorded")
+    if not use_cache and cache_path is not None:
+        show_usage("The options --cache and --no-cache exclude each other")
     if game_opts['mines'] > (game_opts['rows'] * game_opts['cols']):
         show_usage("Too many mines (%i) for a %ix%i playing field" %
                    (game_opts['mines'], game_opts['rows'], game_opts['cols']))
@@ -631,12 +2189,28 @@ def init_ui(game_opts):
     row_count    = game_opts['rows'] if game_opts.has_key('rows') else 16
     column_count = game_opts['cols'] if game_opts.has_key('cols') else 16
     mine_count   = game_opts['mines'] if game_opts.has_key('mines') else 40
+    seed         = game_opts['seed'] if game_opts.has_key('seed') else None
 
-    sweeper = Sweeper(row_count, column_count, mine_count)
+    if cache_path is not None:
+        solvers.pattern_cache.load(cache_path)
+    sweeper = Sweeper(row_count, column_count, mine_count, seed)
 
     sweeper.main()
+    if sweeper.log_file is not None:
+        sweeper.log_file.close()
+    if sweeper.stats is not None:
+        write_profile(sweeper.stats)
+    if cache_path is not None:
+        solvers.pattern_cache.save(cache_path)
     return sweeper
 
+def write_profile(stats):
+    """Print the totals of a SolverStats and write it to the profile file"""
+    stats.print_report()
+    f = open(profile, 'w')
+    stats.write_json(f)
+    f.close()
+
 def main(argv):
     """ Main method of application """
     sweeper = Sweeper()
@@ -663,7 +2237,8 @@ def set_option(options, name, value, minvalue = 0):
         if value > minvalue:
             options[name] = value
         else:
-            fail("bad value for option %s (too small)" % name)
+            show_usage("Bad value (%s) for option %s (too small)" %
+                       (value, name))
 
 def show_usage(error = None):
     """Show usage information, with an error if given, and exit appropriately.
@@ -690,6 +2265,31 @@ def show_usage(error = None):
     print "after every iteration of the solver."
     print "  -p,--print:          Prints the serialized board state in ASP form",
     print "after every user interaction."
+    print "  -b,--backend:        Selects the solver backend: clasp (the",
+    print "default), native, clingo or local."
+    print "  --seed:              Seeds the mine placement, so that a board",
+    print "can be played again."
+    print "  --batch:             Plays the given number of games with the",
+    print "solver, without a window, and prints win rate and timings."
+    print "  --jobs:              Number of processes for --batch (default:",
+    print "one per core); with 1, each game spreads its frontier over them."
+    print "  --no-guess:          Stops the solver when it is stuck instead",
+    print "of opening the tile least likely to be a mine."
+    print "  --profile:           Times every stage of the solver, prints",
+    print "the totals at the end and writes all timings to FILE as JSON."
+    print "  --cache:             Loads the solver's cache of small frontier",
+    print "patterns from FILE, if it exists, and saves it there at the end."
+    print "  --no-cache:          Hands every frontier part the simple rules",
+    print "do not settle to the backend, to time it with --batch or --profile."
+    print "  --chunked:           Generates the playing field a chunk at a",
+    print "time as it is explored, with the same share of mines, so that",
+    print "very large fields take no more memory than the part played."
+    print "  --record:            Records every move to the move log FILE;",
+    print "with --batch, to FILE.SEED for every game."
+    print "  --replay:            Plays the move log FILE back without a",
+    print "window and prints how long it took and how the game ended."
+    print "  --moves:             Stops --replay after the given number of",
+    print "moves; snapshots kept in FILE.snapshots let later runs skip ahead."
     if error is None:
         sys.exit(0)
     else:
@@ -718,4 +2318,9 @@ def show_version():
 
 if __name__=="__main__":
     game_opts = get_options()
-    sweeper = init_ui(game_opts)
+    if game_opts.has_key('replay'):
+        run_replay(game_opts)
+    elif game_opts.has_key('batch'):
+        run_batch(game_opts)
+    else:
+        sweeper = init_ui(game_opts)